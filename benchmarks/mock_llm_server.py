@@ -0,0 +1,242 @@
+"""A local OpenAI-compatible chat completion endpoint for benchmarks.
+
+The "translation" echoes the fenced text of the last user message, after a configurable
+latency and jitter. A configurable share of requests is rejected with HTTP 429, and requests
+containing `fail_marker` always fail with HTTP 500.
+Like OpenAI, a prompt prefix of 1024+ tokens seen before is reported as cached.
+The /files and /batches endpoints stand in for the Batch API: a batch completes after `batch_delay`
+seconds, and the 429 share of its requests fails.
+
+    python -m benchmarks.mock_llm_server --port 8765 --latency 0.5 --jitter 0.2 --rate-429 0.05
+"""
+import json
+import time
+import uuid
+import random
+import asyncio
+import argparse
+from dataclasses import dataclass
+
+from aiohttp import web
+
+
+@dataclass
+class MockSettings:
+    latency: float = 0.2
+    jitter: float = 0.1
+    rate_429: float = 0.0
+    # seconds between two streamed deltas
+    stream_delay: float = 0.0
+    stream_piece: int = 16
+    min_cached_prefix: int = 1024
+    # seconds from creating a batch to its completion
+    batch_delay: float = 1.0
+    fail_marker: str | None = None
+
+
+def echo_translation(messages: list[dict]) -> str:
+    content = messages[-1]['content']
+    if isinstance(content, list):
+        content = ''.join(part.get('text', '') for part in content)
+    parts = content.split('```')
+    text = parts[-2] if len(parts) >= 3 else content
+    return f'```{text}```'
+
+
+def approx_tokens(text: str) -> int:
+    return max(1, len(text) // 4)
+
+
+def prompt_prefix(messages: list[dict]) -> str:
+    """Everything before the fenced chunk text."""
+    return json.dumps(messages, ensure_ascii=False).split('```', 1)[0]
+
+
+class MockLLMServer:
+
+    def __init__(self, settings: MockSettings | None = None, seed: int = 0) -> None:
+        self.settings = settings or MockSettings()
+        self.rng = random.Random(seed)
+        self.requests = 0
+        self.rejected = 0
+        self.failed = 0
+        self.cached_tokens = 0
+        self.prefixes: set[str] = set()
+        self.files: dict[str, bytes] = {}
+        self.batches: dict[str, dict] = {}
+        self.batch_tasks: set[asyncio.Task] = set()
+        self.app = web.Application()
+        for prefix in ('/v1', ''):
+            self.app.router.add_post(f'{prefix}/chat/completions', self.chat_completions)
+            self.app.router.add_post(f'{prefix}/files', self.upload_file)
+            self.app.router.add_get(f'{prefix}/files/{{file_id}}/content', self.file_content)
+            self.app.router.add_post(f'{prefix}/batches', self.create_batch)
+            self.app.router.add_get(f'{prefix}/batches/{{batch_id}}', self.retrieve_batch)
+        self.runner: web.AppRunner | None = None
+
+    async def start(self, host: str = '127.0.0.1', port: int = 0) -> str:
+        """Start serving in the running event loop, returns the API base URL."""
+        self.runner = web.AppRunner(self.app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, host, port)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        return f'http://{host}:{port}/v1'
+
+    async def stop(self) -> None:
+        if self.runner:
+            await self.runner.cleanup()
+
+    def response_delay(self) -> float:
+        return max(0.0, self.settings.latency + self.rng.uniform(-self.settings.jitter, self.settings.jitter))
+
+    async def chat_completions(self, request: web.Request) -> web.StreamResponse:
+        self.requests += 1
+        body = await request.json()
+        if self.settings.fail_marker and self.settings.fail_marker in json.dumps(body['messages'], ensure_ascii=False):
+            self.failed += 1
+            return web.json_response({'error': {'message': 'Internal error (mock)', 'type': 'server_error'}}, status=500)
+        if self.rng.random() < self.settings.rate_429:
+            self.rejected += 1
+            return web.json_response(
+                {'error': {'message': 'Rate limit reached (mock)', 'type': 'requests', 'code': 'rate_limit_exceeded'}},
+                status=429,
+            )
+        await asyncio.sleep(self.response_delay())
+        completion = self.completion(body)
+        if not body.get('stream'):
+            return web.json_response(completion)
+
+        content = completion['choices'][0]['message']['content']
+        usage = completion['usage']
+        base = {k: completion[k] for k in ('id', 'created', 'model')}
+        response = web.StreamResponse(headers={'Content-Type': 'text/event-stream'})
+        await response.prepare(request)
+
+        async def send(payload: dict) -> None:
+            await response.write(f'data: {json.dumps(payload)}\n\n'.encode('utf-8'))
+
+        piece = self.settings.stream_piece
+        for i in range(0, len(content), piece):
+            await send(base | {
+                'object': 'chat.completion.chunk',
+                'choices': [{'index': 0, 'delta': {'content': content[i:i + piece]}, 'finish_reason': None}],
+            })
+            if self.settings.stream_delay:
+                await asyncio.sleep(self.settings.stream_delay)
+        await send(base | {'object': 'chat.completion.chunk',
+                           'choices': [{'index': 0, 'delta': {}, 'finish_reason': 'stop'}]})
+        if (body.get('stream_options') or {}).get('include_usage'):
+            await send(base | {'object': 'chat.completion.chunk', 'choices': [], 'usage': usage})
+        await response.write(b'data: [DONE]\n\n')
+        await response.write_eof()
+        return response
+
+    def completion(self, body: dict) -> dict:
+        content = echo_translation(body['messages'])
+        prompt_tokens = approx_tokens(json.dumps(body['messages'], ensure_ascii=False))
+        prefix = prompt_prefix(body['messages'])
+        cached_tokens = 0
+        if prefix in self.prefixes and approx_tokens(prefix) >= self.settings.min_cached_prefix:
+            cached_tokens = approx_tokens(prefix)
+        self.prefixes.add(prefix)
+        self.cached_tokens += cached_tokens
+        usage = {
+            'prompt_tokens': prompt_tokens,
+            'completion_tokens': approx_tokens(content),
+            'total_tokens': prompt_tokens + approx_tokens(content),
+            'prompt_tokens_details': {'cached_tokens': cached_tokens},
+        }
+        return {
+            'id': f'chatcmpl-{uuid.uuid4().hex}',
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': body.get('model', 'mock'),
+            'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': content}, 'finish_reason': 'stop'}],
+            'usage': usage,
+        }
+
+    async def upload_file(self, request: web.Request) -> web.Response:
+        form = await request.post()
+        file_id = f'file-{uuid.uuid4().hex}'
+        self.files[file_id] = form['file'].file.read()
+        return web.json_response({
+            'id': file_id, 'object': 'file', 'purpose': form.get('purpose'),
+            'bytes': len(self.files[file_id]), 'filename': form['file'].filename,
+        })
+
+    async def file_content(self, request: web.Request) -> web.Response:
+        file_id = request.match_info['file_id']
+        if file_id not in self.files:
+            return web.json_response({'error': {'message': f'No such file: {file_id}'}}, status=404)
+        return web.Response(body=self.files[file_id], content_type='application/octet-stream')
+
+    async def create_batch(self, request: web.Request) -> web.Response:
+        body = await request.json()
+        if body.get('input_file_id') not in self.files:
+            return web.json_response({'error': {'message': 'Unknown input_file_id'}}, status=400)
+        batch_id = f'batch_{uuid.uuid4().hex}'
+        self.batches[batch_id] = {
+            'id': batch_id, 'object': 'batch', 'endpoint': body['endpoint'], 'status': 'validating',
+            'input_file_id': body['input_file_id'], 'completion_window': body['completion_window'],
+            'output_file_id': None, 'error_file_id': None, 'created_at': int(time.time()),
+            'request_counts': {'total': 0, 'completed': 0, 'failed': 0},
+        }
+        task = asyncio.get_running_loop().create_task(self.process_batch(batch_id))
+        self.batch_tasks.add(task)
+        task.add_done_callback(self.batch_tasks.discard)
+        return web.json_response(self.batches[batch_id])
+
+    async def retrieve_batch(self, request: web.Request) -> web.Response:
+        batch = self.batches.get(request.match_info['batch_id'])
+        if batch is None:
+            return web.json_response({'error': {'message': 'No such batch'}}, status=404)
+        return web.json_response(batch)
+
+    async def process_batch(self, batch_id: str) -> None:
+        batch = self.batches[batch_id]
+        lines = self.files[batch['input_file_id']].decode('utf-8').splitlines()
+        batch['status'] = 'in_progress'
+        batch['request_counts']['total'] = len(lines)
+        await asyncio.sleep(self.settings.batch_delay)
+        output = []
+        for line in lines:
+            self.requests += 1
+            record = json.loads(line)
+            result = {'id': f'batch_req_{uuid.uuid4().hex}', 'custom_id': record['custom_id']}
+            if self.rng.random() < self.settings.rate_429:
+                self.rejected += 1
+                batch['request_counts']['failed'] += 1
+                result |= {'response': None, 'error': {'code': 'rate_limit_exceeded', 'message': 'mock'}}
+            else:
+                batch['request_counts']['completed'] += 1
+                result |= {'response': {'status_code': 200, 'body': self.completion(record['body'])}, 'error': None}
+            output.append(json.dumps(result, ensure_ascii=False))
+        output_file_id = f'file-{uuid.uuid4().hex}'
+        self.files[output_file_id] = ('\n'.join(output) + '\n').encode('utf-8')
+        batch['output_file_id'] = output_file_id
+        batch['status'] = 'completed'
+
+
+async def serve_forever(settings: MockSettings, host: str, port: int) -> None:
+    server = MockLLMServer(settings)
+    api_base = await server.start(host, port)
+    print(f'Mock LLM endpoint listening on {api_base}')
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await server.stop()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency', type=float, default=0.2)
+    parser.add_argument('--jitter', type=float, default=0.1)
+    parser.add_argument('--rate-429', type=float, default=0.0)
+    parser.add_argument('--stream-delay', type=float, default=0.0)
+    parser.add_argument('--batch-delay', type=float, default=1.0)
+    args = parser.parse_args()
+    settings = MockSettings(args.latency, args.jitter, args.rate_429, args.stream_delay, batch_delay=args.batch_delay)
+    asyncio.run(serve_forever(settings, args.host, args.port))
@@ -0,0 +1,116 @@
+"""Resume check: a job with one failing chunk, relaunched, against the mock LLM endpoint.
+
+    python -m benchmarks.resume
+    python -m benchmarks.resume --stream --concurrency 8
+
+The requests of one chunk fail with HTTP 500, so the job fails. Every chunk that was translated
+before the job stopped must be in its journal. The job is then launched again into the same
+directory with the failure gone: only the chunks missing from the journal may be requested, the
+output must match a clean run, and the journal must be removed. Exits with 1 if a check fails.
+"""
+import sys
+import json
+import asyncio
+import argparse
+import filecmp
+import tempfile
+from pathlib import Path
+
+from trans_latex import llm
+from trans_latex.llm import LLMServiceConfig
+from trans_latex.chat_prompt import ChatPromptTemplate
+from trans_latex.tex_source import LatexSourcesLoader, LatexParseCache
+from trans_latex.translator import LatexProjectTranslator
+from trans_latex.chunk_size import chunk_size_tuner
+from trans_latex.journal import journal_filename
+
+from benchmarks.synthetic_project import generate_project
+from benchmarks.mock_llm_server import MockLLMServer, MockSettings
+
+
+async def run_check(args: argparse.Namespace) -> dict[str, bool]:
+    # the failing chunk fails at once instead of after minutes of backoff
+    llm.max_attempts = 1
+    server = MockLLMServer(MockSettings(args.latency, args.jitter))
+    api_base = await server.start()
+    checks = {}
+
+    with tempfile.TemporaryDirectory() as tmp:
+        project_dir = generate_project(Path(tmp) / 'project', args.files, 1, args.paragraphs, 0.2, args.seed)
+        # chunk sizes of mock runs must not tune the real ones
+        chunk_size_tuner.path = Path(tmp) / 'chunk_sizes.json'
+        loader = LatexSourcesLoader(project_dir, cache=LatexParseCache(Path(tmp) / 'parsed'))
+        await loader.load_sources()
+
+        def new_translator() -> LatexProjectTranslator:
+            return LatexProjectTranslator(
+                loader,
+                ChatPromptTemplate(),
+                LLMServiceConfig(api_base=api_base, api_key='sk-mock', model='openai/mock-model'),
+                args.chunk_size,
+                max_concurrency=args.concurrency,
+                stream=args.stream,
+            )
+
+        clean_dir, target_dir = Path(tmp) / 'clean', Path(tmp) / 'resumed'
+        clean_dir.mkdir()
+        target_dir.mkdir()
+        translator = new_translator()
+        await translator.translate_project(clean_dir)
+        chunks = translator.plan.num_chunks
+
+        # a chunk in the middle of the main source, requests of the other chunks are in flight when it fails
+        main_chunks = translator.plan.files[0].chunks
+        failing_text = main_chunks[len(main_chunks) // 2].text.strip()
+        server.settings.fail_marker = failing_text[len(failing_text) // 2:][:40]
+        translator = new_translator()
+        requests = server.requests
+        try:
+            await translator.translate_project(target_dir)
+            checks['job failed'] = False
+        except Exception:
+            checks['job failed'] = True
+        # requests still running after the job failed would show up here
+        await asyncio.sleep(2 * args.latency)
+        answered = server.requests - requests - server.failed
+        with open(target_dir / journal_filename, 'r', encoding='utf-8') as f:
+            journaled = {(r['file'], r['index']) for r in map(json.loads, f) if 'job' not in r}
+        checks['every translated chunk journaled'] = answered > 0 and len(journaled) == answered
+
+        server.settings.fail_marker = None
+        requests = server.requests
+        translator = new_translator()
+        await translator.translate_project(target_dir)
+        checks['only missing chunks requested'] = server.requests - requests == chunks - len(journaled)
+        checks['output matches a clean run'] = all(
+            filecmp.cmp(clean_file, target_dir / clean_file.relative_to(clean_dir), shallow=False)
+            for clean_file in clean_dir.rglob('*.tex')
+        )
+        checks['journal removed'] = not (target_dir / journal_filename).exists()
+        print(f'{chunks} chunks, {len(journaled)} journaled by the failed run')
+
+    await llm.close_llm_clients()
+    await server.stop()
+    return checks
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--files', type=int, default=3)
+    parser.add_argument('--paragraphs', type=int, default=15)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--latency', type=float, default=0.2)
+    parser.add_argument('--jitter', type=float, default=0.1)
+    parser.add_argument('--chunk-size', type=int, default=300)
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--stream', action='store_true')
+    args = parser.parse_args()
+
+    checks = asyncio.run(run_check(args))
+    for name, passed in checks.items():
+        print(f'{name:>32}: {"ok" if passed else "FAILED"}')
+    sys.exit(0 if all(checks.values()) else 1)
+
+
+if __name__ == '__main__':
+    main()
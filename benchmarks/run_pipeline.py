@@ -0,0 +1,164 @@
+"""End-to-end throughput benchmark: load -> estimate -> translate -> write, against the mock LLM endpoint.
+
+    python -m benchmarks.run_pipeline --files 8 --depth 2 --paragraphs 40 --concurrency 8 --latency 0.3
+    python -m benchmarks.run_pipeline --stream --json results.json
+    python -m benchmarks.run_pipeline --profile profile.json
+
+Reports the wall time of every stage, chunks/s, tokens/s and the peak RSS of the process.
+No real API is called, no money is spent.
+"""
+import sys
+import json
+import time
+import asyncio
+import argparse
+import resource
+import tempfile
+from pathlib import Path
+
+from trans_latex import llm
+from trans_latex.llm import LLMServiceConfig
+from trans_latex.chat_prompt import ChatPromptTemplate
+from trans_latex.profiling import profiler
+from trans_latex.tex_source import LatexSourcesLoader, LatexParseCache
+from trans_latex.translator import LatexProjectTranslator
+from trans_latex.chunk_size import chunk_size_tuner
+from trans_latex.batch_api import translate_project_in_batch
+from trans_latex.ui.utils import copy_files
+
+from benchmarks.synthetic_project import generate_project
+from benchmarks.mock_llm_server import MockLLMServer, MockSettings
+
+
+def peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+async def run_benchmark(args: argparse.Namespace) -> dict:
+    llm.connection_pooling = not args.no_pool
+    server = MockLLMServer(MockSettings(
+        args.latency, args.jitter, args.rate_429, args.stream_delay, batch_delay=args.batch_delay
+    ))
+    api_base = await server.start()
+    stages: dict[str, float] = {}
+
+    with tempfile.TemporaryDirectory() as tmp:
+        project_dir = generate_project(
+            Path(tmp) / 'project', args.files, args.depth, args.paragraphs, args.math_density, args.seed
+        )
+        target_dir = Path(tmp) / 'translated'
+        target_dir.mkdir()
+        # chunk sizes of mock runs must not tune the real ones
+        chunk_size_tuner.path = Path(tmp) / 'chunk_sizes.json'
+
+        started = time.perf_counter()
+        loader = LatexSourcesLoader(project_dir, cache=LatexParseCache(Path(tmp) / 'parsed'))
+        await loader.load_sources()
+        stages['load'] = time.perf_counter() - started
+
+        translator = LatexProjectTranslator(
+            loader,
+            ChatPromptTemplate(extra_prompt=args.extra_prompt),
+            LLMServiceConfig(api_base=api_base, api_key='sk-mock', model=args.model),
+            args.chunk_size,
+            max_concurrency=args.concurrency,
+            stream=args.stream,
+            mask=args.mask,
+        )
+        started = time.perf_counter()
+        estimate = translator.estimate_total_work()
+        stages['estimate'] = time.perf_counter() - started
+
+        started = time.perf_counter()
+        cloned = await copy_files(project_dir, target_dir, skip=loader.translated_sources())
+        stages['copy'] = time.perf_counter() - started
+
+        started = time.perf_counter()
+        if args.batch_api:
+            await translate_project_in_batch(translator, target_dir, poll_interval=0.2)
+        else:
+            await translator.translate_project(target_dir)
+        stages['translate'] = time.perf_counter() - started
+
+    await llm.close_llm_clients()
+    await server.stop()
+    prompt_tokens, completion_tokens = translator.get_total_usage()
+    total = sum(stages.values())
+    return {
+        'files': len(loader.sources),
+        'chunks': translator.translated_chunks,
+        'chunk_size': translator.chunk_size,
+        'estimated_tokens': estimate.tokens,
+        'saved_tokens': estimate.saved_tokens,
+        'discounted_tokens': estimate.discounted_tokens,
+        'mask_failures': translator.mask_failures,
+        'journaled_chunks': translator.journaled_chunks,
+        'prompt_tokens': prompt_tokens,
+        'completion_tokens': completion_tokens,
+        'cached_prompt_tokens': translator.get_cached_prompt_tokens(),
+        'latency_seconds': translator.telemetry.summary()['latency_seconds'],
+        'retries': translator.telemetry.summary()['retries'],
+        'requests': server.requests,
+        'requests_per_second': round(server.requests / stages['translate'], 1),
+        'rejected_429': server.rejected,
+        'stages': {name: round(seconds, 4) for name, seconds in stages.items()},
+        'wall_time': round(total, 4),
+        'chunks_per_second': round(translator.translated_chunks / stages['translate'], 3),
+        'tokens_per_second': round((prompt_tokens + completion_tokens) / stages['translate'], 1),
+        'cloned_files': dict(cloned),
+        'peak_rss_mb': round(peak_rss_mb(), 1),
+        'prometheus': translator.telemetry.prometheus_text(),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    group = parser.add_argument_group('synthetic project')
+    group.add_argument('--files', type=int, default=4)
+    group.add_argument('--depth', type=int, default=1)
+    group.add_argument('--paragraphs', type=int, default=20)
+    group.add_argument('--math-density', type=float, default=0.2)
+    group.add_argument('--seed', type=int, default=0)
+    group = parser.add_argument_group('mock endpoint')
+    group.add_argument('--latency', type=float, default=0.2)
+    group.add_argument('--jitter', type=float, default=0.1)
+    group.add_argument('--rate-429', type=float, default=0.0)
+    group.add_argument('--stream-delay', type=float, default=0.0)
+    group.add_argument('--batch-delay', type=float, default=1.0)
+    group = parser.add_argument_group('translator')
+    group.add_argument('--model', default='openai/mock-model')
+    group.add_argument('--chunk-size', type=lambda v: None if v == 'auto' else int(v), default=1000,
+                       help='tokens per chunk, or auto')
+    group.add_argument('--concurrency', type=int, default=4)
+    group.add_argument('--stream', action='store_true')
+    group.add_argument('--extra-prompt', help='e.g. a long glossary, which makes the prompt prefix cacheable')
+    group.add_argument('--mask', action='store_true', help='send formulas and references as placeholders')
+    group.add_argument('--batch-api', action='store_true', help='submit the chunks as one Batch API job')
+    group.add_argument('--no-pool', action='store_true', help='leave connections to litellm instead of a shared pool')
+    parser.add_argument('--json', type=Path, help='also write the results to this file')
+    parser.add_argument('--prom', type=Path, help='write the metrics of the run in the Prometheus textfile format')
+    parser.add_argument('--profile', type=Path, help='time the pipeline stages, with cProfile and tracemalloc, '
+                                                     'and write the profile to this file')
+    args = parser.parse_args()
+    if args.profile:
+        profiler.configure(cprofile=True, trace_memory=True)
+
+    results = asyncio.run(run_benchmark(args))
+    prometheus = results.pop('prometheus')
+    if args.prom:
+        args.prom.write_text(prometheus, encoding='utf-8')
+    for key, value in results.items():
+        print(f'{key:>20}: {value}')
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+    if profiler.enabled:
+        print(profiler.summary())
+        if args.profile:
+            profiler.dump(args.profile)
+
+
+if __name__ == '__main__':
+    main()
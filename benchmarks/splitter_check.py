@@ -0,0 +1,133 @@
+"""Equivalence check of `LatexSourceSplitter.split_text` against the string-based algorithm it replaced.
+
+    python -m benchmarks.splitter_check
+    python -m benchmarks.splitter_check --random 500
+
+`split_text` splits by offsets into one index of separator positions. The original algorithm
+split and re-split substrings with str.split. On fixed samples, including separators that
+overlap or are prefixes of each other, and on random sections, both must give the same chunks,
+and the chunks must join back to the text. Exits with 1 on a mismatch.
+"""
+import sys
+import random
+import argparse
+
+from trans_latex.splitter import LatexSourceSplitter, latex_macro_separators
+
+from benchmarks.synthetic_project import random_section
+
+
+def _split(text: str, separator: str) -> list[str]:
+    """delimiter-preserving split operation"""
+    splits = text.split(separator)
+    if len(splits) > 1:
+        new_split = [splits[0]]
+        for split in splits[1:]:
+            new_split.append(separator + split)
+        splits = list(filter(lambda x: x != '', new_split))
+        return splits
+    else:
+        return splits
+
+
+class ReferenceSplitter(LatexSourceSplitter):
+    """The original string-based algorithm. Like `split_text`, it keeps a piece that no separator
+    splits as it is, the original recursed forever on such pieces."""
+
+    def split_text(self, text: str) -> list[str]:
+        final_chunks = []
+        try_split = [text]
+        for _s in self._separators:
+            if _s in text:
+                try_split = _split(text, _s)
+                if len(try_split) > 1:
+                    break
+        splits = try_split
+        _good_splits = []
+        for s in splits:
+            if self._length_function(s) < self._chunk_size:
+                _good_splits.append(s)
+            else:
+                if _good_splits:
+                    final_chunks.extend(self.merge_splits(_good_splits))
+                    _good_splits = []
+                if len(splits) == 1:
+                    final_chunks.append(s)
+                else:
+                    final_chunks.extend(self.split_text(s))
+        if _good_splits:
+            final_chunks.extend(self.merge_splits(_good_splits))
+        return final_chunks
+
+
+latex_sample = r"""\section{Introduction}
+Large language models translate text. We propose a method with $x_1 = \alpha^2$.
+
+\begin{itemize}
+\item first point
+\item second point
+\end{itemize}
+
+$$
+\mathcal{L} = \sum_i \log p(y_i \mid x_i)
+$$
+
+\subsection{Details}
+Consider the following.
+\begin{align}
+a &= b \\
+c &= d
+\end{align}
+\section{Conclusion}
+Done.
+"""
+
+# (text, separators, chunk sizes)
+fixed_samples = [
+    (latex_sample, latex_macro_separators, (20, 60, 200, 1000)),
+    ('', latex_macro_separators, (10,)),
+    ('überall 中文 翻译\n\nnoch ein Absatz\n' * 5, latex_macro_separators, (8, 30)),
+    # separators overlapping themselves and each other
+    ('$$$$$ a $$$ b $$ c $ d $$$$', ['$$$', '$$', '$', ' '], (2, 4, 8)),
+    ('x\n\n\n\ny\n\n\nz\n\nw\n', ['\n\n\n', '\n\n', '\n'], (1, 3, 6)),
+    ('aaaaa b aaa c aa d a', ['aa', 'a', ' '], (1, 2, 5)),
+    ('abababab ba ab aba', ['aba', 'ab', 'b', ' '], (2, 3, 7)),
+    # no separator splits the oversized piece
+    ('x' * 50, [' '], (10,)),
+    ('word ' * 3 + 'y' * 40, [' '], (10,)),
+]
+
+
+def check(text: str, separators: list[str], chunk_size: int) -> bool:
+    splitter = LatexSourceSplitter(chunk_size=chunk_size, length_function=len, separators=separators)
+    reference = ReferenceSplitter(chunk_size=chunk_size, length_function=len, separators=separators)
+    chunks = splitter.split_text(text)
+    return ''.join(chunks) == text and chunks == reference.split_text(text)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--random', type=int, default=100, help='number of random sections')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    failures = []
+    for text, separators, chunk_sizes in fixed_samples:
+        for chunk_size in chunk_sizes:
+            if not check(text, separators, chunk_size):
+                failures.append(f'{text[:30]!r} with {separators[:4]} and chunk size {chunk_size}')
+    rng = random.Random(args.seed)
+    for i in range(args.random):
+        text = random_section(rng, f'Section {i}', rng.randint(1, 12), rng.random())
+        chunk_size = rng.choice((30, 100, 300, 1000))
+        if not check(text, latex_macro_separators, chunk_size):
+            failures.append(f'random section {i} with chunk size {chunk_size}')
+
+    for failure in failures:
+        print(f'mismatch: {failure}')
+    print(f'{len(fixed_samples)} fixed samples, {args.random} random sections, {len(failures)} mismatches')
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
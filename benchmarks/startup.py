@@ -0,0 +1,73 @@
+"""Startup benchmark: time from a fresh interpreter to the first screen of the terminal UI.
+
+    python -m benchmarks.startup
+    python -m benchmarks.startup --runs 10 --max-seconds 1.5
+
+Every run is a new process, so that nothing is imported yet. Reports the import time of the app,
+the time until the welcome screen is mounted (headless), the heavy modules loaded by then, which
+should be none, and how long the background warm-up of litellm and the tokenizer takes afterwards.
+Exits with 1 if the median time to the first screen exceeds --max-seconds or a heavy module was
+imported before it, so that a regression fails CI.
+"""
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+
+
+# must not be imported before the first screen is shown
+heavy_modules = ('litellm', 'openai', 'tiktoken', 'tokenizers')
+
+child_script = f'''
+import sys, json, time, asyncio
+started = time.perf_counter()
+from trans_latex.app import TransLaTeXTUI
+imported = time.perf_counter()
+
+async def first_screen():
+    app = TransLaTeXTUI()
+    async with app.run_test() as pilot:
+        await pilot.pause()
+        return time.perf_counter(), [m for m in {heavy_modules!r} if m in sys.modules]
+
+mounted, loaded = asyncio.run(first_screen())
+from trans_latex.llm import warm_up
+warm_up()
+print(json.dumps({{
+    'import': imported - started,
+    'first_screen': mounted - started,
+    'warm_up': time.perf_counter() - mounted,
+    'heavy_modules': loaded,
+}}))
+'''
+
+
+def measure() -> dict:
+    result = subprocess.run([sys.executable, '-c', child_script], capture_output=True, text=True, check=True)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--max-seconds', type=float, help='fail if the median time to the first screen is longer')
+    args = parser.parse_args()
+
+    runs = [measure() for _ in range(args.runs)]
+    results = {
+        key + '_seconds': round(statistics.median(r[key] for r in runs), 3)
+        for key in ('import', 'first_screen', 'warm_up')
+    }
+    results['heavy_modules'] = sorted({m for r in runs for m in r['heavy_modules']})
+    for key, value in results.items():
+        print(f'{key:>22}: {value}')
+
+    failed = bool(results['heavy_modules'])
+    if args.max_seconds is not None and results['first_screen_seconds'] > args.max_seconds:
+        failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+"""Generates synthetic LaTeX projects of configurable size for benchmarks.
+
+    python -m benchmarks.synthetic_project ./synthetic --files 8 --depth 2 --paragraphs 30 --math-density 0.3
+"""
+import random
+import argparse
+from pathlib import Path
+
+
+words = (
+    'model data training language large results method performance task learning '
+    'network attention layer representation evaluation experiment approach baseline '
+    'we propose show that the of and in to for with on by from this our these which'
+).split()
+
+
+def random_sentence(rng: random.Random, math_density: float) -> str:
+    sentence = ' '.join(rng.choice(words) for _ in range(rng.randint(8, 24))).capitalize()
+    if rng.random() < math_density:
+        sentence += f' with $x_{{{rng.randint(1, 9)}}} = \\alpha^{rng.randint(2, 4)} + \\beta$'
+    if rng.random() < math_density / 4:
+        sentence += f' as shown in \\cite{{ref{rng.randint(1, 99)}}}'
+    return sentence + '.'
+
+
+def random_paragraph(rng: random.Random, math_density: float) -> str:
+    paragraph = ' '.join(random_sentence(rng, math_density) for _ in range(rng.randint(3, 8)))
+    if rng.random() < math_density / 2:
+        paragraph += (
+            '\n\\begin{equation}\n'
+            f'  \\mathcal{{L}} = \\sum_{{i=1}}^{{N}} \\log p(y_i \\mid x_i) + \\lambda \\|\\theta\\|^{rng.randint(1, 2)}\n'
+            '\\end{equation}'
+        )
+    return paragraph
+
+
+def random_section(rng: random.Random, title: str, paragraphs: int, math_density: float) -> str:
+    body = '\n\n'.join(random_paragraph(rng, math_density) for _ in range(paragraphs))
+    return f'\\section{{{title}}}\n{body}\n'
+
+
+def generate_project(root: Path,
+                     files: int = 4,
+                     depth: int = 1,
+                     paragraphs: int = 20,
+                     math_density: float = 0.2,
+                     seed: int = 0,
+                     ) -> Path:
+    """Writes `main.tex` and `files` section files. Every section file `\\input`s a chain
+    of `depth - 1` nested files. Returns the project directory."""
+    rng = random.Random(seed)
+    sections_dir = root / 'sections'
+    sections_dir.mkdir(parents=True, exist_ok=True)
+
+    main_inputs = []
+    for i in range(files):
+        name = f'sections/sec{i}'
+        main_inputs.append(f'\\input{{{name}}}')
+        for level in range(depth):
+            content = random_section(rng, f'Section {i}.{level}', paragraphs, math_density)
+            if level + 1 < depth:
+                content += f'\n\\input{{{name}_{level + 1}}}\n'
+            path = root / f'{name}.tex' if level == 0 else root / f'{name}_{level}.tex'
+            path.write_text(content, encoding='utf-8')
+
+    intro = random_section(rng, 'Introduction', paragraphs, math_density)
+    (root / 'main.tex').write_text(
+        '\\documentclass{article}\n'
+        '\\usepackage{amsmath}\n'
+        '% synthetic benchmark project\n'
+        '\\begin{document}\n'
+        f'{intro}\n'
+        + '\n'.join(main_inputs) +
+        '\n\\end{document}\n',
+        encoding='utf-8'
+    )
+    return root
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('output', type=Path)
+    parser.add_argument('--files', type=int, default=4)
+    parser.add_argument('--depth', type=int, default=1)
+    parser.add_argument('--paragraphs', type=int, default=20)
+    parser.add_argument('--math-density', type=float, default=0.2)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    generate_project(args.output, args.files, args.depth, args.paragraphs, args.math_density, args.seed)
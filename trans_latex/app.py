@@ -8,6 +8,7 @@ from textual.binding import Binding
 from trans_latex.ui.preparation import ConfigScreen
 from trans_latex.ui.welcome import WelcomeScreen
 from trans_latex.ui.progress import ProgressScreen
+from trans_latex.llm import close_llm_clients
 
 
 class TransLaTeXTUI(App):
@@ -26,6 +27,10 @@ class TransLaTeXTUI(App):
 
     def on_mount(self) -> None:
         self.push_screen(WelcomeScreen())
+
+    async def on_unmount(self) -> None:
+        # the pooled connections of the key check and the translation
+        await close_llm_clients()
     
     def action_toggle_dark(self) -> None:
         """An action to toggle dark mode."""
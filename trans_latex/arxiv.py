@@ -0,0 +1,358 @@
+import os
+import re
+import sys
+import gzip
+import time
+import queue
+import shutil
+import sqlite3
+import asyncio
+import tarfile
+import argparse
+from pathlib import Path, PurePosixPath
+
+import aiohttp
+
+
+arxiv_cache_dir = Path('~/.cache/translatex/arxiv').expanduser()
+arxiv_source_url = 'https://arxiv.org/src/{}'
+# network reads and queue items
+read_size = 256 * 1024
+# downloaded chunks waiting for the unpacking thread, bounds the memory in use
+max_queued_chunks = 64
+
+
+class _QueueReader:
+    """Blocking file-like reader over the chunks an event loop puts into a queue. None ends the stream."""
+
+    def __init__(self, chunks: queue.Queue) -> None:
+        self.chunks = chunks
+        self.buffer = bytearray()
+        self.eof = False
+
+    def _fill(self, size: int) -> None:
+        while not self.eof and (size < 0 or len(self.buffer) < size):
+            chunk = self.chunks.get()
+            if chunk is None:
+                self.eof = True
+            else:
+                self.buffer += chunk
+
+    def peek(self, size: int) -> bytes:
+        self._fill(size)
+        return bytes(self.buffer[:size])
+
+    def read(self, size: int = -1) -> bytes:
+        self._fill(size)
+        if size < 0:
+            size = len(self.buffer)
+        data = bytes(self.buffer[:size])
+        del self.buffer[:size]
+        return data
+
+    def drain(self) -> None:
+        """Consume the rest of the stream, so the producer never blocks on a full queue."""
+        while not self.eof:
+            self.buffer.clear()
+            self._fill(read_size)
+
+
+class _PrefixedReader:
+    """Replays the bytes already read for format detection before the rest of the stream."""
+
+    def __init__(self, prefix: bytes, raw) -> None:
+        self.prefix = prefix
+        self.raw = raw
+
+    def read(self, size: int = -1) -> bytes:
+        if not self.prefix:
+            return self.raw.read(size)
+        if size < 0:
+            data, self.prefix = self.prefix + self.raw.read(), b''
+            return data
+        data, self.prefix = self.prefix[:size], self.prefix[size:]
+        if len(data) < size:
+            data += self.raw.read(size - len(data))
+        return data
+
+
+def _safe_member_path(save_dir: Path, name: str) -> Path | None:
+    path = PurePosixPath(name)
+    if path.is_absolute() or '..' in path.parts or not path.parts:
+        return None
+    return save_dir.joinpath(*path.parts)
+
+
+def _write_file(path: Path, fileobj, mtime: float | None = None) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, 'wb') as f:
+        while data := fileobj.read(read_size):
+            f.write(data)
+    if mtime is not None:
+        os.utime(path, (mtime, mtime))
+
+
+def unpack_source_stream(reader: _QueueReader, save_dir: Path, arxiv_identifier: str) -> list[str]:
+    """Runs in a worker thread. Detects the format of an arXiv source as it arrives, then unpacks it:
+    a gzipped or plain tar, a single gzipped file, or a single plain file. Returns the written files."""
+    stream = reader
+    if reader.peek(2) == b'\x1f\x8b':
+        stream = gzip.GzipFile(fileobj=reader, mode='rb')
+    head = stream.read(512)
+    if not head:
+        raise ValueError(f'The source of arXiv {arxiv_identifier} is empty')
+    if head.startswith(b'%PDF'):
+        raise ValueError(f'arXiv {arxiv_identifier} provides no LaTeX sources, only a PDF')
+
+    written = []
+    if len(head) == 512 and head[257:262] == b'ustar':
+        with tarfile.open(fileobj=_PrefixedReader(head, stream), mode='r|') as tar:
+            for member in tar:
+                # links and special files are never needed to translate or compile a paper
+                if not member.isfile():
+                    continue
+                path = _safe_member_path(save_dir, member.name)
+                if path is None:
+                    continue
+                _write_file(path, tar.extractfile(member), member.mtime)
+                written.append(member.name)
+    else:
+        # a single file submission, the original file name is not part of the download
+        name = f'{arxiv_identifier.replace("/", "_")}.tex'
+        _write_file(save_dir / name, _PrefixedReader(head, stream))
+        written.append(name)
+    reader.drain()
+    return written
+
+
+class ArxivSourceCache:
+    """Index of downloaded arXiv sources: identifier -> unpacked tree, HTTP validators and size.
+    Trees are evicted in least-recently-used order once they take more than `max_bytes` on disk."""
+
+    def __init__(self, root: Path = arxiv_cache_dir, max_bytes: int = 2 * 1024 * 1024 * 1024) -> None:
+        root.mkdir(parents=True, exist_ok=True)
+        self.root = root
+        self.max_bytes = max_bytes
+        self.conn = sqlite3.connect(root / 'index.sqlite3')
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS sources ('
+            'identifier TEXT PRIMARY KEY, etag TEXT, last_modified TEXT, '
+            'size INTEGER NOT NULL, fetched REAL NOT NULL, last_used REAL NOT NULL)'
+        )
+        self.conn.commit()
+
+    @staticmethod
+    def is_pinned(identifier: str) -> bool:
+        """A versioned identifier such as 2401.01234v2 never changes."""
+        return re.search(r'v\d+$', identifier) is not None
+
+    def path(self, identifier: str) -> Path:
+        return self.root / identifier.replace('/', '_')
+
+    def lookup(self, identifier: str) -> tuple[str | None, str | None] | None:
+        """(ETag, Last-Modified) of a cached source, None if it is not cached."""
+        row = self.conn.execute(
+            'SELECT etag, last_modified FROM sources WHERE identifier = ?', (identifier,)
+        ).fetchone()
+        if row is None or not self.path(identifier).is_dir():
+            return None
+        return row
+
+    def touch(self, identifier: str) -> None:
+        self.conn.execute('UPDATE sources SET last_used = ? WHERE identifier = ?', (time.time(), identifier))
+        self.conn.commit()
+
+    def record(self, identifier: str, etag: str | None, last_modified: str | None, size: int) -> None:
+        now = time.time()
+        self.conn.execute(
+            'INSERT OR REPLACE INTO sources (identifier, etag, last_modified, size, fetched, last_used) '
+            'VALUES (?, ?, ?, ?, ?, ?)',
+            (identifier, etag, last_modified, size, now, now)
+        )
+        self.conn.commit()
+
+    def entries(self) -> list[tuple[str, int, float, float]]:
+        """(identifier, size, fetched, last used) of every cached source, most recently used first."""
+        return self.conn.execute(
+            'SELECT identifier, size, fetched, last_used FROM sources ORDER BY last_used DESC'
+        ).fetchall()
+
+    def total_size(self) -> int:
+        return self.conn.execute('SELECT COALESCE(SUM(size), 0) FROM sources').fetchone()[0]
+
+    def remove(self, identifier: str) -> None:
+        shutil.rmtree(self.path(identifier), ignore_errors=True)
+        self.conn.execute('DELETE FROM sources WHERE identifier = ?', (identifier,))
+        self.conn.commit()
+
+    def evict(self, max_bytes: int | None = None, keep: str | None = None) -> list[str]:
+        """Remove least recently used sources until the total size is within `max_bytes`, returns them."""
+        max_bytes = self.max_bytes if max_bytes is None else max_bytes
+        total, evicted = self.total_size(), []
+        for identifier, size, _, _ in reversed(self.entries()):
+            if total <= max_bytes:
+                break
+            if identifier == keep:
+                continue
+            self.remove(identifier)
+            total -= size
+            evicted.append(identifier)
+        return evicted
+
+    def close(self) -> None:
+        self.conn.close()
+
+
+def _tree_size(path: Path) -> int:
+    return sum(p.stat().st_size for p in path.rglob('*') if p.is_file())
+
+
+_source_cache: ArxivSourceCache | None = None
+
+
+def get_source_cache() -> ArxivSourceCache:
+    global _source_cache
+    if _source_cache is None:
+        _source_cache = ArxivSourceCache()
+    return _source_cache
+
+
+async def _stream_into(response: aiohttp.ClientResponse, save_dir: Path, arxiv_identifier: str) -> None:
+    """Unpacks the body in a worker thread while it arrives, nothing is kept in between."""
+    chunks: queue.Queue = queue.Queue(maxsize=max_queued_chunks)
+    reader = _QueueReader(chunks)
+    unpacking = asyncio.create_task(asyncio.to_thread(unpack_source_stream, reader, save_dir, arxiv_identifier))
+
+    async def put(chunk: bytes | None) -> None:
+        while True:
+            try:
+                chunks.put_nowait(chunk)
+                return
+            except queue.Full:
+                # the unpacking thread is behind, or has failed and will never catch up
+                if unpacking.done():
+                    return
+                await asyncio.sleep(0.01)
+
+    try:
+        async for chunk in response.content.iter_chunked(read_size):
+            # the unpacking thread stops early only on errors
+            if unpacking.done():
+                break
+            await put(chunk)
+    except BaseException:
+        # end the stream, the download error is the one to report
+        if not unpacking.done():
+            await put(None)
+        await asyncio.gather(unpacking, return_exceptions=True)
+        raise
+    if not unpacking.done():
+        await put(None)
+    await unpacking
+
+
+async def download_arxiv_source(arxiv_identifier: str, cache: ArxivSourceCache | None = None) -> Path:
+    """Download and unpack the LaTeX sources of an arXiv paper, returns the project directory.
+    Cached sources of a pinned version are used without any request, others are revalidated
+    with their ETag or Last-Modified and only downloaded again when they changed."""
+    cache = cache or get_source_cache()
+    save_dir = cache.path(arxiv_identifier)
+    validators = cache.lookup(arxiv_identifier)
+    if validators is not None and cache.is_pinned(arxiv_identifier):
+        cache.touch(arxiv_identifier)
+        return save_dir
+
+    headers = {}
+    if validators is not None:
+        etag, last_modified = validators
+        if etag:
+            headers['If-None-Match'] = etag
+        if last_modified:
+            headers['If-Modified-Since'] = last_modified
+
+    url = arxiv_source_url.format(arxiv_identifier)
+    # a new version is unpacked next to the cached one, which stays usable until the swap
+    partial_dir = save_dir.with_name(f'{save_dir.name}.partial-{os.getpid()}')
+    try:
+        async with aiohttp.ClientSession() as session:
+            async with session.get(url, headers=headers) as response:
+                if response.status == 304 and validators is not None:
+                    cache.touch(arxiv_identifier)
+                    return save_dir
+                if response.status >= 500 and validators is not None:
+                    print(f'Could not revalidate arXiv {arxiv_identifier} (HTTP {response.status}), using the cached sources')
+                    cache.touch(arxiv_identifier)
+                    return save_dir
+                if response.status != 200:
+                    raise ValueError(f'Downloading {url} failed with HTTP status {response.status}')
+                shutil.rmtree(partial_dir, ignore_errors=True)
+                partial_dir.mkdir(parents=True)
+                await _stream_into(response, partial_dir, arxiv_identifier)
+                etag, last_modified = response.headers.get('ETag'), response.headers.get('Last-Modified')
+    except aiohttp.ClientError as e:
+        shutil.rmtree(partial_dir, ignore_errors=True)
+        if validators is None:
+            raise
+        print(f'Could not revalidate arXiv {arxiv_identifier}, using the cached sources: {e}')
+        cache.touch(arxiv_identifier)
+        return save_dir
+    except BaseException:
+        shutil.rmtree(partial_dir, ignore_errors=True)
+        raise
+
+    shutil.rmtree(save_dir, ignore_errors=True)
+    os.replace(partial_dir, save_dir)
+    cache.record(arxiv_identifier, etag, last_modified, await asyncio.to_thread(_tree_size, save_dir))
+    for evicted in cache.evict(keep=arxiv_identifier):
+        print(f'Evicted arXiv {evicted} from the source cache')
+    return save_dir
+
+
+def _format_size(size: float) -> str:
+    for unit in ('B', 'KiB', 'MiB', 'GiB'):
+        if size < 1024 or unit == 'GiB':
+            return f'{size:.1f} {unit}' if unit != 'B' else f'{int(size)} B'
+        size /= 1024
+
+
+def _parse_size(text: str) -> int:
+    match = re.fullmatch(r'\s*([\d.]+)\s*([KMG]?)i?B?\s*', text, re.IGNORECASE)
+    if match is None:
+        raise argparse.ArgumentTypeError(f'invalid size: {text}')
+    return int(float(match.group(1)) * 1024 ** ' KMG'.index(match.group(2).upper() or ' '))
+
+
+def run_cache_cli() -> None:
+    parser = argparse.ArgumentParser(prog='trans-latex-cache', description='Inspect and prune the arXiv source cache.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    subparsers.add_parser('list', help='list cached sources, most recently used first')
+    prune = subparsers.add_parser('prune', help='evict least recently used sources')
+    prune.add_argument('--max-size', type=_parse_size, default=None,
+                       help='size to prune down to, e.g. 500M (default: the cache limit)')
+    remove = subparsers.add_parser('remove', help='remove cached sources')
+    remove.add_argument('identifiers', nargs='+')
+    subparsers.add_parser('clear', help='remove all cached sources')
+    args = parser.parse_args()
+
+    cache = get_source_cache()
+    if args.command == 'list':
+        for identifier, size, fetched, last_used in cache.entries():
+            print(f'{identifier:<24} {_format_size(size):>10}  '
+                  f'fetched {time.strftime("%Y-%m-%d %H:%M", time.localtime(fetched))}  '
+                  f'used {time.strftime("%Y-%m-%d %H:%M", time.localtime(last_used))}')
+        print(f'{len(cache.entries())} sources, {_format_size(cache.total_size())} in {cache.root}')
+    elif args.command == 'prune':
+        evicted = cache.evict(args.max_size)
+        print(f'Evicted {len(evicted)} sources, {_format_size(cache.total_size())} left')
+    elif args.command == 'remove':
+        for identifier in args.identifiers:
+            cache.remove(identifier)
+    elif args.command == 'clear':
+        evicted = cache.evict(0)
+        print(f'Removed {len(evicted)} sources')
+    cache.close()
+    sys.exit(0)
+
+
+if __name__ == '__main__':
+    run_cache_cli()
@@ -0,0 +1,246 @@
+"""Headless batch translation of many LaTeX projects, without the terminal UI.
+
+Usage:
+    trans-latex-batch --config config.yaml 1706.03762 2303.18223 ./my-paper/
+
+The config file (YAML or JSON) holds the LLM service, the prompt settings and the chunk size:
+
+    llm:
+      api_base: https://api.openai.com/v1
+      api_key: sk-xxxxxxxx
+      model: gpt-3.5-turbo
+      temperature: 0.1
+    src_lang: English
+    tgt_lang: Chinese
+    extra_prompt: "- 'LLM' should be translated as '大语言模型'"
+    chunk_size: 1000      # or auto, fitted to the model and tuned by earlier runs
+    max_concurrency: 8    # LLM requests in flight, shared by all projects
+    project_workers: 2    # projects processed at the same time
+    output_dir: ./translated
+    stream: false         # write responses to the output files as they arrive
+    mask: false           # send formulas and references as [M1], [M2], ... placeholders
+    batch_api: false      # submit each project as one Batch API job, cheaper but slow
+    batch_poll_interval: 60
+    prometheus_textfile: /var/lib/node_exporter/translatex.prom   # optional metrics of the whole batch
+    rate_limits:          # client-side limits per model and/or API base
+      - model: gpt-3.5-turbo
+        rpm: 500
+        tpm: 80000
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+from dataclasses import dataclass, field, fields
+from pathlib import Path
+
+import yaml
+
+from trans_latex.llm import LLMServiceConfig, get_llm_client, close_llm_clients
+from trans_latex.rate_limit import set_rate_limit
+from trans_latex.chat_prompt import ChatPromptTemplate
+from trans_latex.tex_source import LatexSourcesLoader
+from trans_latex.translator import LatexProjectTranslator
+from trans_latex.batch_api import translate_project_in_batch
+from trans_latex.telemetry import RunTelemetry
+from trans_latex.profiling import profiler, profile_filename
+from trans_latex.cache import TranslationCache
+from trans_latex.arxiv import download_arxiv_source
+from trans_latex.ui.utils import copy_files
+
+
+@dataclass
+class BatchConfig:
+    llm: LLMServiceConfig = field(default_factory=LLMServiceConfig)
+    src_lang: str = 'English'
+    tgt_lang: str = 'Chinese'
+    extra_prompt: str | None = None
+    # None picks the size automatically
+    chunk_size: int | None = 1000
+    max_concurrency: int = 4
+    project_workers: int = 2
+    output_dir: Path = Path('./translated')
+    use_cache: bool = True
+    stream: bool = False
+    mask: bool = False
+    # translate through the Batch API of the service, polled every `batch_poll_interval` seconds
+    batch_api: bool = False
+    batch_poll_interval: float = 60.0
+    # written after the batch, for the textfile collector of node_exporter
+    prometheus_textfile: Path | None = None
+    # e.g. [{'model': 'gpt-3.5-turbo', 'rpm': 500, 'tpm': 80000}], 'api_base' selects a whole API
+    rate_limits: list[dict] = field(default_factory=list)
+
+    @classmethod
+    def from_file(cls, path: Path) -> 'BatchConfig':
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f) if path.suffix == '.json' else yaml.safe_load(f)
+        llm_data = data.pop('llm', {})
+        unknown = set(data) - {f.name for f in fields(cls)}
+        if unknown:
+            raise ValueError(f'Unknown options in {path}: {", ".join(sorted(unknown))}')
+        if data.get('chunk_size') == 'auto':
+            data['chunk_size'] = None
+        config = cls(llm=LLMServiceConfig(**llm_data), **data)
+        config.output_dir = Path(config.output_dir).expanduser()
+        if config.prometheus_textfile:
+            config.prometheus_textfile = Path(config.prometheus_textfile).expanduser()
+        if not config.llm.api_key:
+            config.llm.api_key = os.environ.get('OPENAI_API_KEY', '')
+        return config
+
+    def create_prompt_template(self) -> ChatPromptTemplate:
+        return ChatPromptTemplate(
+            src_lang=self.src_lang,
+            tgt_lang=self.tgt_lang,
+            extra_prompt=self.extra_prompt,
+        )
+
+
+class BatchRunner:
+    """Translates projects with a pool of project workers.
+    All translators share one request semaphore, so `max_concurrency` bounds the requests of the whole batch."""
+
+    def __init__(self, config: BatchConfig) -> None:
+        self.config = config
+        self.request_semaphore = asyncio.Semaphore(config.max_concurrency)
+        # every project sends through the same connection pool
+        get_llm_client(config.llm, max_connections=config.max_concurrency)
+        self.project_semaphore = asyncio.Semaphore(config.project_workers)
+        self.cache = TranslationCache() if config.use_cache else None
+        # requests of all projects
+        self.telemetry = RunTelemetry(config.llm.model, config.chunk_size)
+        for limit in config.rate_limits:
+            set_rate_limit(**limit)
+
+    @staticmethod
+    def project_name(project: str) -> str:
+        local_dir = Path(project).expanduser()
+        return local_dir.resolve().name if local_dir.is_dir() else project.replace('/', '_')
+
+    async def prepare_project_dir(self, project: str) -> Path:
+        local_dir = Path(project).expanduser()
+        if local_dir.is_dir():
+            return local_dir
+        return await download_arxiv_source(project)
+
+    async def translate(self, project: str) -> dict:
+        summary = {
+            'project': project,
+            'status': 'ok',
+            'error': None,
+            'output_dir': None,
+            'duration': 0.0,
+            'load_time': 0.0,
+            'warnings': [],
+            'chunks': 0,
+            'prompt_tokens': 0,
+            'completion_tokens': 0,
+        }
+        async with self.project_semaphore:
+            started = time.perf_counter()
+            try:
+                project_dir = await self.prepare_project_dir(project)
+                loader = LatexSourcesLoader(project_dir)
+                if not await loader.load_sources():
+                    raise ValueError(f'Main document source is not found in {project_dir}')
+                summary['load_time'] = round(loader.load_time, 3)
+                summary['warnings'] = loader.warnings
+
+                target_dir = self.config.output_dir / self.project_name(project)
+                target_dir.mkdir(parents=True, exist_ok=True)
+                await copy_files(project_dir, target_dir, skip=loader.translated_sources())
+                summary['output_dir'] = str(target_dir)
+
+                translator = LatexProjectTranslator(
+                    loader,
+                    self.config.create_prompt_template(),
+                    self.config.llm,
+                    self.config.chunk_size,
+                    cache=self.cache,
+                    stream=self.config.stream,
+                    mask=self.config.mask,
+                )
+                translator.request_semaphore = self.request_semaphore
+                if self.config.batch_api:
+                    await translate_project_in_batch(translator, target_dir, self.config.batch_poll_interval)
+                else:
+                    await translator.translate_project(target_dir)
+
+                summary['chunks'] = translator.translated_chunks
+                summary['chunk_size'] = translator.chunk_size
+                summary['prompt_tokens'], summary['completion_tokens'] = translator.get_total_usage()
+                summary['cached_prompt_tokens'] = translator.get_cached_prompt_tokens()
+                summary['saved_tokens'] = translator.plan.estimate().saved_tokens
+                summary['mask_failures'] = translator.mask_failures
+                summary['journaled_chunks'] = translator.journaled_chunks
+                summary['telemetry'] = translator.telemetry.summary()
+                self.telemetry.extend(translator.telemetry)
+            except Exception as e:
+                summary['status'] = 'failed'
+                summary['error'] = f'{type(e).__name__}: {e}'
+            summary['duration'] = round(time.perf_counter() - started, 3)
+        print(f'[{summary["status"]}] {project} in {summary["duration"]:.1f}s', file=sys.stderr)
+        return summary
+
+    async def run(self, projects: list[str]) -> list[dict]:
+        try:
+            return await asyncio.gather(*(self.translate(p) for p in projects))
+        finally:
+            await close_llm_clients()
+            self.telemetry.finish()
+            if self.config.prometheus_textfile:
+                self.telemetry.write_prometheus(self.config.prometheus_textfile)
+
+
+def run_batch_cli() -> None:
+    parser = argparse.ArgumentParser(
+        prog='trans-latex-batch',
+        description='Translate LaTeX projects (arXiv identifiers or local directories) without the terminal UI.',
+    )
+    parser.add_argument('projects', nargs='*', help='arXiv identifiers or project directories')
+    parser.add_argument('-c', '--config', type=Path, required=True, help='YAML or JSON config file')
+    parser.add_argument('-f', '--projects-file', type=Path, help='file with one project per line')
+    parser.add_argument('-o', '--output-dir', type=Path, help='overrides output_dir of the config')
+    parser.add_argument('-s', '--summary', type=Path, help='where to write the JSON summary '
+                                                           '(default: <output_dir>/summary.json)')
+    parser.add_argument('--profile', action='store_true', help='time the pipeline stages and write '
+                                                               f'<output_dir>/{profile_filename}')
+    args = parser.parse_args()
+    if args.profile and not profiler.enabled:
+        profiler.configure()
+
+    config = BatchConfig.from_file(args.config)
+    if args.output_dir:
+        config.output_dir = args.output_dir.expanduser()
+    projects = list(args.projects)
+    if args.projects_file:
+        with open(args.projects_file, 'r', encoding='utf-8') as f:
+            projects.extend(line.strip() for line in f if line.strip() and not line.startswith('#'))
+    if not projects:
+        parser.error('no project given')
+
+    started = time.perf_counter()
+    results = asyncio.run(BatchRunner(config).run(projects))
+    summary = {
+        'model': config.llm.model,
+        'duration': round(time.perf_counter() - started, 3),
+        'succeeded': sum(r['status'] == 'ok' for r in results),
+        'failed': sum(r['status'] != 'ok' for r in results),
+        'projects': results,
+    }
+    summary_path = args.summary or config.output_dir / 'summary.json'
+    summary_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(summary_path, 'w', encoding='utf-8') as f:
+        json.dump(summary, f, ensure_ascii=False, indent=2)
+    print(f'Summary written to {summary_path}', file=sys.stderr)
+    if profiler.enabled:
+        profiler.dump(config.output_dir / profile_filename)
+        print(profiler.summary(), file=sys.stderr)
+    sys.exit(1 if summary['failed'] else 0)
+
+
+if __name__ == '__main__':
+    run_batch_cli()
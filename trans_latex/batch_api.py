@@ -0,0 +1,220 @@
+"""Translation through the Batch API of OpenAI-compatible services: cheaper and with higher rate
+limits, but results arrive within hours instead of seconds.
+
+Every chunk of the translation plan that needs a request becomes one line of a JSONL batch file,
+with the translation cache key as its custom ID. The batch is uploaded, created and polled, and
+the results are handed to `LatexProjectTranslator.translate_project`, which writes the project as
+usual. Chunks the batch failed to translate are requested one by one there.
+
+The job state is kept in the output directory, a restarted job polls the batch it created before.
+"""
+import sys
+import json
+import hashlib
+import asyncio
+from dataclasses import dataclass, asdict
+from pathlib import Path
+
+import aiohttp
+
+from trans_latex.llm import resolve_model, load_litellm
+from trans_latex.translator import LatexProjectTranslator
+
+
+batch_state_filename = '.translatex-batch.json'
+batch_output_filename = '.translatex-batch-output.jsonl'
+completion_window = '24h'
+final_statuses = {'completed', 'failed', 'expired', 'cancelled'}
+
+
+@dataclass
+class BatchJobState:
+    # digest of the translation plan, a changed plan starts a new batch
+    fingerprint: str
+    input_file_id: str | None = None
+    batch_id: str | None = None
+    status: str | None = None
+    output_file_id: str | None = None
+    error_file_id: str | None = None
+
+
+def _plain_messages(messages: list[dict]) -> list[dict]:
+    """Messages without cache_control markers, which the batch endpoints do not accept."""
+    plain = []
+    for message in messages:
+        content = message['content']
+        if isinstance(content, list):
+            content = [{k: v for k, v in part.items() if k != 'cache_control'} for part in content]
+        plain.append(message | {'content': content})
+    return plain
+
+
+class BatchTranslationJob:
+
+    def __init__(self, translator: LatexProjectTranslator, target_dir: Path, poll_interval: float = 60.0) -> None:
+        self.translator = translator
+        self.config = translator.api_config
+        self.api_base = self.config.api_base.rstrip('/')
+        self.state_path = target_dir / batch_state_filename
+        self.output_path = target_dir / batch_output_filename
+        self.poll_interval = poll_interval
+        self.state: BatchJobState | None = None
+        self.session: aiohttp.ClientSession | None = None
+
+    def plan_fingerprint(self) -> str:
+        """Digest of every chunk of the plan, cached or not, with the model and the prompt template.
+        Unlike the batch file, it stays the same when chunks are cached between a crash and the restart."""
+        plan = self.translator.plan
+        digest = hashlib.sha256(json.dumps({
+            'model': plan.model,
+            'temperature': self.config.temperature,
+            'template': plan.template.prefix_messages(),
+            'mask': plan.mask,
+        }, ensure_ascii=False, sort_keys=True).encode('utf-8'))
+        for planned_file in plan.files:
+            for chunk in planned_file.chunks:
+                # reused chunks have no messages and so no cache key
+                digest.update((chunk.cache_key or f'reused:{chunk.text}').encode('utf-8') + b'\0')
+        return digest.hexdigest()
+
+    def build_batch_file(self) -> bytes:
+        """One request per distinct chunk that is neither reused nor cached."""
+        model, _, _, _ = load_litellm().get_llm_provider(resolve_model(self.config))
+        lines = {}
+        for planned_file in self.translator.plan.files:
+            for chunk in planned_file.chunks:
+                if chunk.reused is not None or chunk.cached or chunk.cache_key in lines:
+                    continue
+                lines[chunk.cache_key] = json.dumps({
+                    'custom_id': chunk.cache_key,
+                    'method': 'POST',
+                    'url': '/v1/chat/completions',
+                    'body': {
+                        'model': model,
+                        'messages': _plain_messages(chunk.messages),
+                        'temperature': self.config.temperature,
+                    },
+                }, ensure_ascii=False)
+        return ''.join(line + '\n' for line in lines.values()).encode('utf-8')
+
+    def load_state(self, fingerprint: str) -> BatchJobState:
+        if self.state_path.exists():
+            with open(self.state_path, 'r', encoding='utf-8') as f:
+                state = BatchJobState(**json.load(f))
+            if state.fingerprint == fingerprint:
+                return state
+            print(f'The translation plan changed, a new batch replaces {state.batch_id}', file=sys.stderr)
+        return BatchJobState(fingerprint)
+
+    def save_state(self) -> None:
+        with open(self.state_path, 'w', encoding='utf-8') as f:
+            json.dump(asdict(self.state), f, indent=2)
+
+    async def request(self, method: str, path: str, **kwargs) -> aiohttp.ClientResponse:
+        response = await self.session.request(method, self.api_base + path, **kwargs)
+        if response.status >= 400:
+            text = await response.text()
+            response.release()
+            raise RuntimeError(f'{method} {path} failed with HTTP {response.status}: {text[:500]}')
+        return response
+
+    async def upload(self, content: bytes) -> str:
+        form = aiohttp.FormData()
+        form.add_field('purpose', 'batch')
+        form.add_field('file', content, filename='translatex-batch.jsonl', content_type='application/jsonl')
+        async with await self.request('POST', '/files', data=form) as response:
+            return (await response.json())['id']
+
+    async def create_batch(self) -> dict:
+        payload = {
+            'input_file_id': self.state.input_file_id,
+            'endpoint': '/v1/chat/completions',
+            'completion_window': completion_window,
+        }
+        async with await self.request('POST', '/batches', json=payload) as response:
+            return await response.json()
+
+    async def retrieve_batch(self) -> dict:
+        async with await self.request('GET', f'/batches/{self.state.batch_id}') as response:
+            return await response.json()
+
+    async def download(self, file_id: str) -> bytes:
+        async with await self.request('GET', f'/files/{file_id}/content') as response:
+            return await response.read()
+
+    def update_state(self, batch: dict) -> None:
+        self.state.status = batch['status']
+        self.state.output_file_id = batch.get('output_file_id')
+        self.state.error_file_id = batch.get('error_file_id')
+        self.save_state()
+
+    async def wait_for_batch(self) -> None:
+        while self.state.status not in final_statuses:
+            await asyncio.sleep(self.poll_interval)
+            batch = await self.retrieve_batch()
+            counts = batch.get('request_counts') or {}
+            print(f'Batch {self.state.batch_id}: {batch["status"]}, '
+                  f'{counts.get("completed", 0)}/{counts.get("total", "?")} done', file=sys.stderr)
+            self.update_state(batch)
+
+    def read_results(self, output: bytes) -> dict[str, dict]:
+        """Chat completion bodies by custom ID. Failed requests are left out, and so are chunks
+        cached since the batch was submitted, which are taken from the cache."""
+        cached = {chunk.cache_key for f in self.translator.plan.files for chunk in f.chunks if chunk.cached}
+        results = {}
+        for line in output.decode('utf-8').splitlines():
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            response = record.get('response') or {}
+            if record.get('error') or response.get('status_code') != 200 or record['custom_id'] in cached:
+                continue
+            results[record['custom_id']] = response['body']
+        return results
+
+    async def run(self) -> dict[str, dict]:
+        """Submit the batch, or resume the one submitted before, and wait for its results."""
+        if not self.translator.plan_matches(self.translator.plan):
+            self.translator.plan = self.translator.build_plan()
+        content = self.build_batch_file()
+        if not content:
+            return {}
+        self.state = self.load_state(self.plan_fingerprint())
+        if self.state.status == 'completed' and self.output_path.exists():
+            return self.read_results(self.output_path.read_bytes())
+
+        headers = {'Authorization': f'Bearer {self.config.api_key}'}
+        async with aiohttp.ClientSession(headers=headers) as self.session:
+            if self.state.batch_id is None:
+                self.state.input_file_id = await self.upload(content)
+                self.save_state()
+                batch = await self.create_batch()
+                self.state.batch_id = batch['id']
+                self.update_state(batch)
+                n_requests = content.count(b'\n')
+                print(f'Submitted batch {self.state.batch_id} with {n_requests} requests', file=sys.stderr)
+            else:
+                print(f'Resuming batch {self.state.batch_id}', file=sys.stderr)
+            await self.wait_for_batch()
+            if self.state.status != 'completed' or not self.state.output_file_id:
+                print(f'Batch {self.state.batch_id} ended as {self.state.status}, '
+                      f'its chunks are translated one by one', file=sys.stderr)
+                return {}
+            output = await self.download(self.state.output_file_id)
+        self.output_path.write_bytes(output)
+        return self.read_results(output)
+
+    def finish(self) -> None:
+        """Forget the batch once the project is written."""
+        self.state_path.unlink(missing_ok=True)
+        self.output_path.unlink(missing_ok=True)
+
+
+async def translate_project_in_batch(translator: LatexProjectTranslator,
+                                     target_dir: Path,
+                                     poll_interval: float = 60.0,
+                                     ) -> None:
+    job = BatchTranslationJob(translator, target_dir, poll_interval)
+    translator.batch_results = await job.run()
+    await translator.translate_project(target_dir)
+    job.finish()
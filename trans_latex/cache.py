@@ -0,0 +1,87 @@
+import time
+import json
+import sqlite3
+import hashlib
+from pathlib import Path
+
+from trans_latex.llm import LLMServiceConfig
+
+
+default_cache_path = Path('~/.cache/translatex/translations.sqlite3').expanduser()
+
+
+class TranslationCache:
+    """Persistent content-addressed cache of chunk translations.
+    Entries are evicted in least-recently-used order once the stored translations exceed `max_bytes`."""
+
+    def __init__(self, path: Path = default_cache_path, max_bytes: int = 256 * 1024 * 1024) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.conn = sqlite3.connect(path)
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS translations ('
+            'key TEXT PRIMARY KEY, translation TEXT NOT NULL, size INTEGER NOT NULL, last_used REAL NOT NULL)'
+        )
+        self.conn.execute('CREATE INDEX IF NOT EXISTS translations_last_used ON translations (last_used)')
+        self.conn.commit()
+        self.total_size = self.conn.execute('SELECT COALESCE(SUM(size), 0) FROM translations').fetchone()[0]
+
+    @staticmethod
+    def make_key(llm_config: LLMServiceConfig, messages: list[dict[str, str]]) -> str:
+        # the rendered messages contain both the chunk text and the prompt template
+        payload = json.dumps(
+            {'model': llm_config.model, 'temperature': llm_config.temperature, 'messages': messages},
+            ensure_ascii=False,
+            sort_keys=True,
+        )
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def contains(self, key: str) -> bool:
+        """Look up a key without touching the counters or the LRU order."""
+        row = self.conn.execute('SELECT 1 FROM translations WHERE key = ?', (key,)).fetchone()
+        return row is not None
+
+    def get(self, key: str) -> str | None:
+        row = self.conn.execute('SELECT translation FROM translations WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.conn.execute('UPDATE translations SET last_used = ? WHERE key = ?', (time.time(), key))
+        self.conn.commit()
+        return row[0]
+
+    def put(self, key: str, translation: str) -> None:
+        size = len(translation.encode('utf-8'))
+        # a replaced entry no longer counts
+        row = self.conn.execute('SELECT size FROM translations WHERE key = ?', (key,)).fetchone()
+        self.conn.execute(
+            'INSERT OR REPLACE INTO translations (key, translation, size, last_used) VALUES (?, ?, ?, ?)',
+            (key, translation, size, time.time())
+        )
+        self.conn.commit()
+        self.total_size += size - (row[0] if row else 0)
+        if self.total_size > self.max_bytes:
+            self.evict()
+
+    def evict(self) -> None:
+        """Drop least recently used entries until the cache is below 90% of its size limit."""
+        # other processes may share the database, so recount before deleting anything
+        self.total_size = self.conn.execute('SELECT COALESCE(SUM(size), 0) FROM translations').fetchone()[0]
+        target_size = int(self.max_bytes * 0.9)
+        if self.total_size <= target_size:
+            return
+        evicted_keys = []
+        for key, size in self.conn.execute('SELECT key, size FROM translations ORDER BY last_used'):
+            if self.total_size <= target_size:
+                break
+            evicted_keys.append((key,))
+            self.total_size -= size
+        self.conn.executemany('DELETE FROM translations WHERE key = ?', evicted_keys)
+        self.conn.commit()
+
+    def close(self) -> None:
+        self.conn.close()
@@ -11,6 +11,10 @@ Instructions:
 
 """.strip()
 
+placeholder_instruction = """
+- Placeholders like [M1], [M2] stand for formulas and references. Keep every placeholder exactly once and unchanged, in the position that fits the translated sentence.
+""".strip()
+
 default_system_prompt = "You are a helpful assistant, proficient in multiple languages."
 
 
@@ -29,14 +33,34 @@ class ChatPromptTemplate:
         extra_prompt = extra_prompt.strip() if extra_prompt else ''
         instruction_prompt = instruction.format(src_lang=src_lang, tgt_lang=tgt_lang)
 
-        self.user_prompt = instruction_prompt + '\n\n' + extra_prompt + '\n\n```\n{text_input}\n```'
+        # identical for every chunk of a project, so providers can cache it as a prompt prefix
+        self.static_prompt = instruction_prompt + '\n\n' + extra_prompt
+        self.text_prompt = '```\n{text_input}\n```'
+        # for chunks with formulas and references masked by placeholders
+        self.masked_text_prompt = placeholder_instruction + '\n\n' + self.text_prompt
 
-    def create_messages(self, text_input: str) -> list[dict[str, str]]:
+    def create_messages(self, text_input: str, masked: bool = False, cacheable: bool = False) -> list[dict]:
+        """With `cacheable`, the static prefix is a separate content block marked for prompt caching."""
+        text_prompt = (self.masked_text_prompt if masked else self.text_prompt).format(text_input=text_input)
+        if not cacheable:
+            return [
+                {"role": "system", "content": self.system_prompt},
+                {"role": "user", "content": self.static_prompt + '\n\n' + text_prompt},
+            ]
         return [
             {"role": "system", "content": self.system_prompt},
-            {"role": "user", "content": self.user_prompt.format(text_input=text_input)},
+            {"role": "user", "content": [
+                {"type": "text", "text": self.static_prompt + '\n\n', "cache_control": {"type": "ephemeral"}},
+                {"type": "text", "text": text_prompt},
+            ]},
         ]
 
+    def prefix_messages(self) -> list[dict[str, str]]:
+        """The part of every request that stays the same, to count its tokens."""
+        return [
+            {"role": "system", "content": self.system_prompt},
+            {"role": "user", "content": self.static_prompt},
+        ]
 
 if __name__ == '__main__':
     template = ChatPromptTemplate()
@@ -0,0 +1,97 @@
+"""Automatic chunk size: bounded by the context window and output limit of the model, then tuned
+from the latency and the failures of the requests of earlier runs."""
+import json
+import time
+import statistics
+from pathlib import Path
+
+from trans_latex.llm import load_litellm
+from trans_latex.telemetry import RequestMetrics
+
+
+chunk_stats_path = Path('~/.cache/translatex/chunk_sizes.json').expanduser()
+default_chunk_size = 1000
+min_chunk_size = 200
+# assumed for models missing from the litellm model map
+fallback_context_tokens = 8192
+# tokens of the translation per token of the source, translations into CJK languages run longer
+completion_ratio = 1.3
+# headroom for the inaccuracy of token counting
+context_margin = 0.9
+# a slow request holds back the rest of its file, and a retry repeats all of it
+target_latency = 60.0
+max_failure_rate = 0.05
+grow_factor, shrink_factor = 1.25, 0.7
+# too few requests say nothing about the latency of a chunk size
+min_observations = 4
+
+
+def chunk_size_limit(model: str, prompt_tokens: int) -> int:
+    """Largest chunk whose prompt and translation fit the limits of the model."""
+    try:
+        info = load_litellm().get_model_info(model)
+    except Exception:
+        info = {}
+    max_input = info.get('max_input_tokens') or info.get('max_tokens') or fallback_context_tokens
+    max_output = info.get('max_output_tokens') or info.get('max_tokens') or max_input
+    # the prompt, the chunk and its translation share the context window
+    by_context = (max_input - prompt_tokens) / (1 + completion_ratio)
+    by_output = max_output / completion_ratio
+    return max(min_chunk_size, int(context_margin * min(by_context, by_output)))
+
+
+class ChunkSizeTuner:
+    """Chunk size per model, adjusted after every run and kept in a JSON file."""
+
+    def __init__(self, path: Path = chunk_stats_path) -> None:
+        self.path = path
+        self.stats: dict[str, dict] | None = None
+
+    def load(self) -> dict[str, dict]:
+        if self.stats is None:
+            try:
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    self.stats = json.load(f)
+            except (OSError, ValueError):
+                self.stats = {}
+        return self.stats
+
+    def save(self) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.path, 'w', encoding='utf-8') as f:
+            json.dump(self.stats, f, indent=2)
+
+    def suggest(self, model: str, limit: int) -> int:
+        size = self.load().get(model, {}).get('chunk_size', default_chunk_size)
+        return max(min_chunk_size, min(size, limit))
+
+    def update(self, model: str, chunk_size: int, requests: list[RequestMetrics], limit: int) -> int | None:
+        """Shrink after truncations, failures or slow requests, grow while requests stay fast.
+        Returns the new chunk size, None if there were too few requests to tell."""
+        # results of the Batch API say nothing about latency
+        observations = [r for r in requests if r.kind != 'batch']
+        if len(observations) < min_observations:
+            return None
+        failure_rate = sum(o.failed or o.truncated for o in observations) / len(observations)
+        latencies = [o.latency for o in observations if not o.failed]
+        p90_latency = statistics.quantiles(latencies, n=10)[-1] if len(latencies) >= 2 else target_latency
+        if failure_rate > max_failure_rate or p90_latency > target_latency:
+            size = chunk_size * shrink_factor
+        elif p90_latency * grow_factor < target_latency:
+            size = chunk_size * grow_factor
+        else:
+            size = chunk_size
+        size = max(min_chunk_size, min(int(size), limit))
+        self.load()[model] = {
+            'chunk_size': size,
+            'observed_chunk_size': chunk_size,
+            'requests': len(observations),
+            'p90_latency': round(p90_latency, 3),
+            'failure_rate': round(failure_rate, 4),
+            'updated': time.time(),
+        }
+        self.save()
+        return size
+
+
+chunk_size_tuner = ChunkSizeTuner()
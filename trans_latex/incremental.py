@@ -0,0 +1,58 @@
+import json
+from pathlib import Path
+
+from trans_latex.splitter import LatexSourceSplitter
+
+
+manifest_filename = 'translatex_chunks.json'
+
+
+class PreviousTranslation:
+    """Chunk-level record of an earlier translation of the project.
+    It is written next to the translated files and lets a new version of the sources reuse the unchanged chunks."""
+
+    def __init__(self, chunks: dict[str, list[tuple[str, str]]]) -> None:
+        self.chunks = chunks
+        # exact chunk matches across all files, e.g. for paragraphs moved to another file
+        self.known_chunks: dict[str, str] = {}
+        for records in chunks.values():
+            for source_chunk, translation in records:
+                self.known_chunks.setdefault(source_chunk, translation)
+
+    @classmethod
+    def from_dir(cls, translated_dir: Path) -> 'PreviousTranslation | None':
+        manifest_path = translated_dir / manifest_filename
+        if not manifest_path.is_file():
+            return None
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        return cls({name: [tuple(r) for r in records] for name, records in data['files'].items()})
+
+    @staticmethod
+    def dumps(chunks: dict[str, list[tuple[str, str]]]) -> str:
+        return json.dumps({'version': 1, 'files': chunks}, ensure_ascii=False)
+
+    def plan_chunks(self, source: str, text: str, splitter: LatexSourceSplitter) -> list[tuple[str, str | None]]:
+        """Split `text` into chunks and attach the previous translation to every unchanged chunk.
+        Old chunks of the same file that still occur in order are kept as they are, only the
+        text between them is split again and marked for translation (`None`)."""
+        results = []
+        cursor = 0
+
+        def add_new_text(end: int) -> None:
+            if end <= cursor:
+                return
+            for chunk in splitter.split_text(text[cursor:end]):
+                results.append((chunk, self.known_chunks.get(chunk)))
+
+        for source_chunk, translation in self.chunks.get(source, []):
+            if not source_chunk.strip():
+                continue
+            pos = text.find(source_chunk, cursor)
+            if pos < 0:
+                continue
+            add_new_text(pos)
+            results.append((source_chunk, translation))
+            cursor = pos + len(source_chunk)
+        add_new_text(len(text))
+        return results
@@ -0,0 +1,95 @@
+"""Append-only journal of the chunks a translation job has received, kept in the output directory.
+
+Every translated chunk is appended as one JSON line and flushed to disk as soon as it arrives. A
+job that was killed or cancelled with Ctrl+C and is launched again into the same directory takes
+these chunks from the journal and requests only the rest. A line cut short by a crash is ignored.
+
+The first line describes the job; a journal of a different model, chunk size or masking setting
+is started over. Records also carry the hash of their chunk and its cache key, so that chunks of
+edited sources or prompts are requested again. The journal is removed once the project is written.
+"""
+import os
+import json
+import hashlib
+from pathlib import Path
+
+from trans_latex.plan import PlannedChunk
+
+
+journal_filename = '.translatex-journal.jsonl'
+
+
+def chunk_hash(text: str) -> str:
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+class JobJournal:
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        # job description of the journal on disk, None if there is none
+        self.header: dict | None = None
+        self.entries: dict[tuple[str | None, int], dict] = {}
+        self._file = None
+        # the last line was cut short, the next record must start on a new line
+        self._torn = False
+
+    def load(self) -> dict | None:
+        """Read the journal of an earlier run, returns its job description."""
+        if not self.path.exists():
+            return None
+        with open(self.path, 'r', encoding='utf-8') as f:
+            content = f.read()
+        self._torn = bool(content) and not content.endswith('\n')
+        for line in content.splitlines():
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if 'job' in record:
+                self.header = record['job']
+            elif self.header is not None:
+                self.entries[(record['file'], record['index'])] = record
+        return self.header
+
+    def open(self, header: dict) -> None:
+        """Continue the journal if it belongs to the same job, start a new one otherwise."""
+        if self.header == header:
+            self._file = open(self.path, 'a', encoding='utf-8')
+            if self._torn:
+                self._file.write('\n')
+            return
+        self.header, self.entries = header, {}
+        self._file = open(self.path, 'w', encoding='utf-8')
+        self._append({'job': header})
+
+    def lookup(self, source: str | None, index: int, chunk: PlannedChunk) -> str | None:
+        entry = self.entries.get((source, index))
+        if entry is None or entry['key'] != chunk.cache_key or entry['hash'] != chunk_hash(chunk.text):
+            return None
+        return entry['translation']
+
+    def record(self, source: str | None, index: int, chunk: PlannedChunk, translation: str) -> None:
+        self._append({
+            'file': source,
+            'index': index,
+            'hash': chunk_hash(chunk.text),
+            'key': chunk.cache_key,
+            'translation': translation,
+        })
+
+    def _append(self, record: dict) -> None:
+        self._file.write(json.dumps(record, ensure_ascii=False) + '\n')
+        # on disk before the next chunk, a crash loses at most the line being written
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self) -> None:
+        if self._file:
+            self._file.close()
+            self._file = None
+
+    def finish(self) -> None:
+        """Forget the job once the project is written."""
+        self.close()
+        self.path.unlink(missing_ok=True)
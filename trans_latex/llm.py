@@ -1,18 +1,49 @@
 
-from dataclasses import dataclass, asdict
-import litellm
+from dataclasses import dataclass, asdict, astuple, replace
+from itertools import accumulate
+import time
+import asyncio
+import inspect
+import logging
+import functools
+import threading
+import aiohttp
 import tenacity
 
-litellm.set_verbose = True
-litellm.register_model({
-    "deepseek-chat": {
-        "max_tokens": 16_000, 
-        "input_cost_per_token": 0.0, 
-        "output_cost_per_token": 0.0, 
-        "litellm_provider": "openai", 
-        "mode": "chat"
-    },
-})
+from trans_latex.rate_limit import get_rate_limiter
+
+
+logger = logging.getLogger(__name__)
+_litellm_lock = threading.Lock()
+
+
+@functools.cache
+def _load_litellm():
+    import litellm
+    litellm.set_verbose = True
+    litellm.register_model({
+        "deepseek-chat": {
+            "max_tokens": 16_000, 
+            "input_cost_per_token": 0.0, 
+            "output_cost_per_token": 0.0, 
+            "litellm_provider": "openai", 
+            "mode": "chat"
+        },
+    })
+    return litellm
+
+
+def load_litellm():
+    """The litellm module, imported and set up on first use: the import takes seconds, which the
+    terminal UI must not spend before its first screen."""
+    with _litellm_lock:
+        return _load_litellm()
+
+
+def warm_up(model: str = 'gpt-3.5-turbo') -> None:
+    """Import litellm and load the tokenizer of `model` ahead of their first use, meant for a
+    background thread while the user fills in the configuration."""
+    count_tokens(text='warm-up', model=model)
 
 
 @dataclass
@@ -24,6 +55,7 @@ class LLMServiceConfig:
 
 
 def chat_completion(llm_config: LLMServiceConfig, messages: list[dict[str, str]]):
+    litellm = load_litellm()
     response = litellm.completion(
         messages=messages,
         stream=False,
@@ -33,24 +65,209 @@ def chat_completion(llm_config: LLMServiceConfig, messages: list[dict[str, str]]
     return response, completion_cost
 
 
-@tenacity.retry(
-    stop=tenacity.stop_after_attempt(5),
-    wait=tenacity.wait_exponential(multiplier=5, exp_base=2, max=60),
-    reraise=True,
-)
-async def async_chat_completion(llm_config: LLMServiceConfig, messages: list[dict[str, str]], **kwargs):
+# requests of one client share a keep-alive connection pool,
+# with False every request goes through the connection handling of litellm
+connection_pooling = True
+
+
+@functools.cache
+def _accepts_shared_session() -> bool:
+    # older litellm versions do not take a session
+    return 'shared_session' in inspect.signature(load_litellm().acompletion).parameters
+
+
+# attempts of a request before it fails for good
+max_attempts = 5
+
+
+def _retrying(retry: tenacity.retry_base = tenacity.retry_if_exception_type()) -> tenacity.AsyncRetrying:
+    return tenacity.AsyncRetrying(
+        stop=tenacity.stop_after_attempt(max_attempts),
+        wait=tenacity.wait_exponential(multiplier=5, exp_base=2, max=60),
+        retry=retry,
+        reraise=True,
+    )
+
+
+class LLMClient:
+    """Long-lived client of one LLM service configuration. The provider is resolved once, and all
+    requests reuse one keep-alive connection pool, sized to the largest concurrency any caller
+    reserved. Get instances with `get_llm_client`."""
+
+    def __init__(self, llm_config: LLMServiceConfig) -> None:
+        self.config = llm_config
+        self.model = resolve_model(llm_config)
+        _, self.provider, _, _ = load_litellm().get_llm_provider(self.model)
+        self.max_connections = 1
+        self.session: aiohttp.ClientSession | None = None
+        # the event loop the session was opened in, a session cannot be used from another one
+        self.session_loop: asyncio.AbstractEventLoop | None = None
+        self.pool_size = 0
+        # smaller pools replaced by a larger one, open until `close` so that their requests finish
+        self.retired_sessions: list[aiohttp.ClientSession] = []
+
+    def reserve_connections(self, n: int) -> None:
+        self.max_connections = max(self.max_connections, n)
+
+    def get_session(self) -> aiohttp.ClientSession | None:
+        if not connection_pooling or not _accepts_shared_session():
+            return None
+        loop = asyncio.get_running_loop()
+        if self.session_loop is not loop:
+            # sessions of an earlier event loop cannot be used or closed from this one
+            self.retired_sessions = []
+        elif self.session and not self.session.closed:
+            if self.pool_size >= self.max_connections:
+                return self.session
+            self.retired_sessions.append(self.session)
+        connector = aiohttp.TCPConnector(
+            limit=self.max_connections, limit_per_host=self.max_connections, keepalive_timeout=60
+        )
+        self.session, self.pool_size = aiohttp.ClientSession(connector=connector), self.max_connections
+        self.session_loop = loop
+        return self.session
+
+    def completion_kwargs(self) -> dict:
+        # retries are left to `_retrying` alone, so that they are counted and backed off the same way
+        kwargs = asdict(self.config) | {'model': self.model, 'max_retries': 0}
+        if session := self.get_session():
+            kwargs['shared_session'] = session
+        return kwargs
+
+    async def close(self) -> None:
+        for session in self.retired_sessions:
+            await session.close()
+        self.retired_sessions = []
+        if self.session:
+            await self.session.close()
+            self.session = None
+
+    async def attempt_completion(self, messages: list[dict[str, str]], prompt_tokens: int | None, metrics, **kwargs):
+        """`metrics`, if given, gets the number of retries and adds the rate limit waits to its `queue_wait`."""
+        async for attempt in _retrying():
+            with attempt:
+                if metrics is not None:
+                    metrics.retries = attempt.retry_state.attempt_number - 1
+                waiting = time.perf_counter()
+                await wait_for_rate_limit(self.config, messages, prompt_tokens)
+                if metrics is not None:
+                    metrics.queue_wait += time.perf_counter() - waiting
+                return await load_litellm().acompletion(messages=messages, **self.completion_kwargs(), **kwargs)
+
+    async def chat_completion(self,
+                              messages: list[dict[str, str]],
+                              prompt_tokens: int | None = None,
+                              metrics=None,
+                              **kwargs):
+        response = await self.attempt_completion(messages, prompt_tokens, metrics, stream=False, **kwargs)
+        record_completion_tokens(self.config, response.usage.completion_tokens)
+        return response
+
+    async def chat_completion_stream(self,
+                                     messages: list[dict[str, str]],
+                                     prompt_tokens: int | None = None,
+                                     metrics=None,
+                                     **kwargs):
+        """Opens a streamed completion. Only opening the stream is retried, the returned
+        object yields the response chunks and ends with one carrying the token usage.
+        Callers should report the completion tokens with `record_completion_tokens`."""
+        return await self.attempt_completion(
+            messages, prompt_tokens, metrics, stream=True, stream_options={'include_usage': True}, **kwargs
+        )
+
+    async def check_valid_key(self) -> bool:
+        """Checks if the API key is valid for the model. A successful check is remembered
+        for the process, so it costs one small completion per key."""
+        key = (self.config.api_base, self.config.api_key, self.config.model)
+        if key in _valid_keys:
+            return True
+        litellm = load_litellm()
+        # a rejected key or an unknown model fails again on a retry, timeouts and overloads may not
+        rejected = (
+            litellm.AuthenticationError,
+            litellm.PermissionDeniedError,
+            litellm.NotFoundError,
+            litellm.BadRequestError,
+        )
+        try:
+            async for attempt in _retrying(tenacity.retry_if_not_exception_type(rejected)):
+                with attempt:
+                    await litellm.acompletion(
+                        messages=[{"role": "user", "content": "Hey, how's it going?"}],
+                        max_tokens=5,
+                        **self.completion_kwargs(),
+                    )
+        except Exception as e:
+            logger.warning('API key check of %s at %s failed: %s', self.config.model, self.config.api_base, e)
+            return False
+        _valid_keys.add(key)
+        return True
+
+
+# (api_base, api_key, model) of keys that passed `check_valid_key`
+_valid_keys: set[tuple[str, str, str]] = set()
+_llm_clients: dict[tuple, LLMClient] = {}
+
+
+def get_llm_client(llm_config: LLMServiceConfig, max_connections: int = 1) -> LLMClient:
+    """The shared client of a service configuration, with at least `max_connections` pooled connections."""
+    key = astuple(llm_config)
+    if key not in _llm_clients:
+        # a copy, later changes to the caller's config must not affect the shared client
+        _llm_clients[key] = LLMClient(replace(llm_config))
+    client = _llm_clients[key]
+    client.reserve_connections(max_connections)
+    return client
+
+
+async def close_llm_clients() -> None:
+    for client in _llm_clients.values():
+        await client.close()
+
+
+async def async_chat_completion(llm_config: LLMServiceConfig,
+                                messages: list[dict[str, str]],
+                                prompt_tokens: int | None = None,
+                                **kwargs):
+    return await get_llm_client(llm_config).chat_completion(messages, prompt_tokens, **kwargs)
+
+
+async def async_chat_completion_stream(llm_config: LLMServiceConfig,
+                                       messages: list[dict[str, str]],
+                                       prompt_tokens: int | None = None,
+                                       **kwargs):
+    return await get_llm_client(llm_config).chat_completion_stream(messages, prompt_tokens, **kwargs)
+
+
+async def wait_for_rate_limit(llm_config: LLMServiceConfig,
+                             messages: list[dict[str, str]],
+                             prompt_tokens: int | None = None,
+                             ) -> None:
+    """Wait until the request fits the client-side rate limit of its model or API base, if any.
+    `prompt_tokens` saves counting the tokens of the messages again."""
+    limiter = get_rate_limiter(llm_config.api_base, llm_config.model)
+    if limiter:
+        if prompt_tokens is None:
+            prompt_tokens = count_tokens(messages=messages, model=llm_config.model)
+        await limiter.acquire(prompt_tokens)
+
+
+def record_completion_tokens(llm_config: LLMServiceConfig, completion_tokens: int | None) -> None:
+    limiter = get_rate_limiter(llm_config.api_base, llm_config.model)
+    if limiter and completion_tokens:
+        limiter.record_completion(completion_tokens)
+
+
+def resolve_model(llm_config: LLMServiceConfig) -> str:
+    """Model name with a provider litellm knows, unknown models are sent to OpenAI-compatible APIs."""
+    # the shared config is not mutated, the model name is part of cache keys
+    model = llm_config.model
+    litellm = load_litellm()
     try:
-        litellm.get_llm_provider(llm_config.model)
+        litellm.get_llm_provider(model)
     except litellm.exceptions.BadRequestError as e:
-        llm_config.model = f'openai/{llm_config.model}'
-    response = await litellm.acompletion(
-        messages=messages,
-        stream=False,
-        **asdict(llm_config),
-        **kwargs
-        # mock_response="It's simple to use and easy to get started"
-    )
-    return response
+        model = f'openai/{model}'
+    return model
 
 
 """
@@ -76,27 +293,91 @@ async def async_chat_completion(llm_config: LLMServiceConfig, messages: list[dic
 """
 
 
-async def check_valid_key(llm_config: LLMServiceConfig):
+async def check_valid_key(llm_config: LLMServiceConfig) -> bool:
     """    Checks if a given API key is valid for a specific model    """
-    try:
-        await async_chat_completion(
-            llm_config=llm_config,
-            messages=[{"role": "user", "content": "Hey, how's it going?"}],
-            max_tokens=5
-        )
-        return True
-    except litellm.AuthenticationError as e:
-        print(e)
-        return False
-    except Exception as e:
-        print(e)
-        return False
+    return await get_llm_client(llm_config).check_valid_key()
+
+
+@functools.cache
+def get_tokenizer(model: str) -> dict:
+    """The tokenizer litellm uses for `model`, loaded once per model name."""
+    return load_litellm().utils._select_tokenizer(model)
+
+
+_utf8_continuation_bytes = bytes(range(0x80, 0xC0))
+
 
+@functools.cache
+def _token_char_counts(encoding) -> list[int]:
+    """Number of characters starting within each token of a tiktoken encoding"""
+    counts = []
+    for token in range(encoding.n_vocab):
+        try:
+            token_bytes = encoding.decode_single_token_bytes(token)
+        except KeyError:
+            token_bytes = b''
+        counts.append(len(token_bytes.translate(None, _utf8_continuation_bytes)))
+    return counts
 
-def count_tokens(text: str | None = None, messages: list[dict[str, str]] | None = None) -> int:
+
+def token_offsets(text: str, model: str = '') -> list[int]:
+    """Tokenize `text` once and return the character offset where each token starts."""
+    tokenizer = get_tokenizer(model)
+    if tokenizer['type'] == 'openai_tokenizer':
+        encoding = tokenizer['tokenizer']
+        tokens = encoding.encode(text, disallowed_special=())
+        return list(accumulate(map(_token_char_counts(encoding).__getitem__, tokens), initial=0))[:-1]
+    encoding = tokenizer['tokenizer'].encode(text, add_special_tokens=False)
+    return [start for start, _ in encoding.offsets]
+
+
+def count_tokens(text: str | None = None, messages: list[dict[str, str]] | None = None, model: str = '') -> int:
+    litellm = load_litellm()
     ret = 0
     if text:
-        ret += litellm.token_counter("", text=text)
+        ret += litellm.token_counter(model, text=text)
     if messages:
-        ret += litellm.token_counter("", messages=messages)
+        ret += litellm.token_counter(model, messages=messages)
     return ret
+
+
+# providers cache prompt prefixes of at least this many tokens only
+min_cached_prefix_tokens = 1024
+
+
+def supports_prompt_caching(model: str) -> bool:
+    try:
+        return load_litellm().utils.supports_prompt_caching(model)
+    except Exception:
+        return False
+
+
+def needs_cache_markers(model: str) -> bool:
+    """Whether the provider caches a prompt prefix only if it is marked with cache_control. OpenAI,
+    DeepSeek and most others cache prefixes on their own, unmarked messages keep their cache keys."""
+    if not supports_prompt_caching(model):
+        return False
+    try:
+        _, provider, _, _ = load_litellm().get_llm_provider(model)
+    except Exception:
+        return False
+    # Claude models, also when served through Bedrock or Vertex AI
+    return provider == 'anthropic' or (provider in ('bedrock', 'vertex_ai') and 'claude' in model)
+
+
+def prompt_cache_discount(model: str) -> float:
+    """Share of the input price saved on prompt tokens read from the provider cache, 0 if unknown."""
+    try:
+        info = load_litellm().get_model_info(model)
+    except Exception:
+        return 0.0
+    input_cost, cached_cost = info.get('input_cost_per_token'), info.get('cache_read_input_token_cost')
+    if not input_cost or cached_cost is None:
+        return 0.0
+    return max(0.0, 1 - cached_cost / input_cost)
+
+
+def cached_prompt_tokens(usage) -> int:
+    """Prompt tokens the provider read from its cache, litellm reports them the OpenAI way for all providers."""
+    details = getattr(usage, 'prompt_tokens_details', None)
+    return getattr(details, 'cached_tokens', None) or 0
@@ -0,0 +1,111 @@
+import re
+from dataclasses import dataclass
+
+from pylatexenc.latexwalker import (
+    LatexNode,
+    LatexCommentNode,
+    LatexEnvironmentNode,
+    LatexGroupNode,
+    LatexMacroNode,
+    LatexMathNode,
+)
+
+
+# formulas and references the LLM has to return verbatim anyway
+maskable_environments = {
+    'equation', 'equation*', 'align', 'align*', 'alignat', 'alignat*', 'gather', 'gather*',
+    'multline', 'multline*', 'flalign', 'flalign*', 'eqnarray', 'eqnarray*', 'displaymath', 'math',
+}
+maskable_macros = {
+    'cite', 'citep', 'citet', 'citealp', 'citealt', 'citeauthor', 'citeyear', 'nocite',
+    'ref', 'eqref', 'autoref', 'cref', 'Cref', 'pageref', 'label', 'url', 'includegraphics',
+}
+# shorter spans cost about as many tokens as their placeholder
+min_mask_length = 8
+# spans with text that needs translating are sent as they are
+_translatable_text_pattern = re.compile(r'\\(text|mbox|intertext|shortintertext|textrm|textit|textbf|textnormal)\b')
+# the LLM may add spaces or switch to full-width brackets
+placeholder_pattern = re.compile(r'[\[［]\s*M\s*(\d+)\s*[\]］]')
+
+
+@dataclass
+class MaskedText:
+    text: str
+    # the span each placeholder stands for, [M1] is the first
+    originals: list[str]
+
+
+def _collect_spans(node: LatexNode, offset: int, spans: list[tuple[int, int]]) -> None:
+    """Spans of the maskable nodes within `node`, which starts at `offset` of the text."""
+    start = offset
+    if isinstance(node, LatexMathNode) or \
+       (isinstance(node, LatexEnvironmentNode) and node.envname in maskable_environments) or \
+       (isinstance(node, LatexMacroNode) and node.macroname in maskable_macros):
+        spans.append((start, start + node.len))
+        return
+    children = []
+    if isinstance(node, (LatexEnvironmentNode, LatexGroupNode)):
+        children = node.nodelist
+    elif isinstance(node, LatexMacroNode) and node.nodeargd:
+        children = node.nodeargd.argnlist
+    for child in children:
+        if child is not None:
+            _collect_spans(child, offset + child.pos - node.pos, spans)
+
+
+def find_maskable_spans(node_list: list[LatexNode]) -> list[tuple[int, int]]:
+    """(start, end) offsets of formulas and references in the text `LatexSourcesLoader.get_text_from_nodes`
+    makes of the same nodes, in order."""
+    spans, offset = [], 0
+    for node in node_list:
+        if node is None or isinstance(node, LatexCommentNode):
+            continue
+        _collect_spans(node, offset, spans)
+        offset += node.len
+    return spans
+
+
+def mask_text(text: str, spans: list[tuple[int, int]]) -> MaskedText:
+    """Replace the spans, relative to `text`, by numbered placeholders. A text that already contains
+    something looking like a placeholder is left alone, it could not be restored unambiguously."""
+    if placeholder_pattern.search(text):
+        return MaskedText(text, [])
+    parts, originals, position = [], [], 0
+    for start, end in spans:
+        original = text[start:end]
+        if len(original) < min_mask_length or _translatable_text_pattern.search(original):
+            continue
+        originals.append(original)
+        parts.append(text[position:start])
+        parts.append(f'[M{len(originals)}]')
+        position = end
+    parts.append(text[position:])
+    return MaskedText(''.join(parts), originals)
+
+
+def mask_chunks(chunks: list[str], spans: list[tuple[int, int]]) -> list[MaskedText]:
+    """Mask consecutive chunks of a text, each span fully inside one chunk. Placeholders are
+    numbered per chunk, so the same chunk always gives the same prompt."""
+    masked, chunk_start, i = [], 0, 0
+    for chunk in chunks:
+        chunk_end = chunk_start + len(chunk)
+        while i < len(spans) and spans[i][0] < chunk_start:
+            i += 1
+        chunk_spans = []
+        while i < len(spans) and spans[i][0] < chunk_end:
+            start, end = spans[i]
+            # a span cut by the chunk boundary stays as it is
+            if end <= chunk_end:
+                chunk_spans.append((start - chunk_start, end - chunk_start))
+            i += 1
+        masked.append(mask_text(chunk, chunk_spans))
+        chunk_start = chunk_end
+    return masked
+
+
+def unmask(translation: str, originals: list[str]) -> str | None:
+    """Put the original spans back. None unless every placeholder occurs exactly once."""
+    found = [int(n) for n in placeholder_pattern.findall(translation)]
+    if sorted(found) != list(range(1, len(originals) + 1)):
+        return None
+    return placeholder_pattern.sub(lambda m: originals[int(m.group(1)) - 1], translation)
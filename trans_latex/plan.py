@@ -0,0 +1,97 @@
+from dataclasses import dataclass, field
+
+from trans_latex.chat_prompt import ChatPromptTemplate
+from trans_latex.llm import min_cached_prefix_tokens
+
+
+@dataclass
+class WorkEstimate:
+    chunks: int = 0
+    tokens: int = 0
+    cached_chunks: int = 0
+    reused_chunks: int = 0
+    # prompt and completion tokens not spent thanks to placeholder masking
+    saved_tokens: int = 0
+    # prompt tokens of the static prefix that can be read from the provider cache
+    cached_prompt_tokens: int = 0
+    # tokens with cached prompt tokens weighted by their price
+    discounted_tokens: int = 0
+
+    def __add__(self, other: 'WorkEstimate') -> 'WorkEstimate':
+        return WorkEstimate(
+            self.chunks + other.chunks,
+            self.tokens + other.tokens,
+            self.cached_chunks + other.cached_chunks,
+            self.reused_chunks + other.reused_chunks,
+            self.saved_tokens + other.saved_tokens,
+            self.cached_prompt_tokens + other.cached_prompt_tokens,
+            self.discounted_tokens + other.discounted_tokens,
+        )
+
+
+@dataclass
+class PlannedChunk:
+    text: str
+    # translation carried over from the previous version of the project, needs no request
+    reused: str | None = None
+    messages: list[dict[str, str]] | None = None
+    prompt_tokens: int = 0
+    # the translation is about as long as the chunk itself
+    completion_tokens: int = 0
+    cache_key: str | None = None
+    # found in the translation cache when the plan was made
+    cached: bool = False
+    # the spans masked by [M1], [M2], ... in the messages
+    placeholders: list[str] = field(default_factory=list)
+    # tokens of the chunk minus tokens of the masked chunk
+    saved_tokens: int = 0
+
+
+@dataclass
+class PlannedFile:
+    source: str
+    # file name in the output directory
+    output: str
+    chunks: list[PlannedChunk]
+    # untranslated text around the chunks, e.g. the preamble of the main source
+    prefix: str = ''
+    suffix: str = ''
+
+
+@dataclass
+class TranslationPlan:
+    """Everything a translation job sends, worked out once: files -> ordered chunks -> rendered
+    messages and token counts. Cost estimation builds it, the progress bar is sized from it and the
+    translator executes it."""
+    model: str
+    chunk_size: int
+    template: ChatPromptTemplate
+    mask: bool = False
+    files: list[PlannedFile] = field(default_factory=list)
+    # tokens of the system prompt and instructions every request starts with
+    prefix_tokens: int = 0
+    # share of the price saved on cached prompt tokens, 0 without prompt caching
+    cache_discount: float = 0.0
+
+    @property
+    def num_chunks(self) -> int:
+        return sum(len(f.chunks) for f in self.files)
+
+    def estimate(self) -> WorkEstimate:
+        estimate = WorkEstimate(chunks=self.num_chunks)
+        for planned_file in self.files:
+            for chunk in planned_file.chunks:
+                if chunk.reused is not None:
+                    estimate.reused_chunks += 1
+                elif chunk.cached:
+                    estimate.cached_chunks += 1
+                else:
+                    estimate.tokens += chunk.prompt_tokens + chunk.completion_tokens
+                    # once in the prompt, once in the completion
+                    estimate.saved_tokens += 2 * chunk.saved_tokens
+        requested = estimate.chunks - estimate.cached_chunks - estimate.reused_chunks
+        # every request after the first can read the prefix from the cache, at best
+        if requested and self.cache_discount and self.prefix_tokens >= min_cached_prefix_tokens:
+            estimate.cached_prompt_tokens = (requested - 1) * self.prefix_tokens
+        estimate.discounted_tokens = estimate.tokens - round(estimate.cached_prompt_tokens * self.cache_discount)
+        return estimate
@@ -0,0 +1,173 @@
+"""Opt-in profiling of the pipeline stages: load, detect_main, include_resolution, parse,
+text_extraction, split, estimate, translate, write and copy.
+
+Enabled with the TRANSLATEX_PROFILE environment variable: `1` times the stages, `cprofile` and
+`tracemalloc` (comma separated, or `all`) add a cProfile and the allocations of each stage.
+
+Spans nest and, in asyncio, overlap. Stage timers count every span, but the cProfile of a thread
+and the allocation peak belong to the outermost span active at the time, which is where the
+time and memory of nested spans show up.
+"""
+import os
+import json
+import time
+import pstats
+import cProfile
+import threading
+import tracemalloc
+from contextlib import contextmanager
+from dataclasses import dataclass
+from pathlib import Path
+
+
+profile_filename = 'translatex-profile.json'
+# functions and allocation sites listed per stage in the dump
+top_entries = 25
+
+
+@dataclass
+class StageTimer:
+    count: int = 0
+    total: float = 0.0
+    max: float = 0.0
+    # bytes still allocated at the end of the spans, summed
+    allocated: int = 0
+    # highest traced memory while the stage was the outermost span
+    peak: int = 0
+
+    def add(self, elapsed: float) -> None:
+        self.count += 1
+        self.total += elapsed
+        self.max = max(self.max, elapsed)
+
+
+class PipelineProfiler:
+
+    def __init__(self) -> None:
+        self.enabled = False
+        self.cprofile = False
+        self.tracemalloc = False
+        self.reset()
+
+    def configure(self, enabled: bool = True, cprofile: bool = False, trace_memory: bool = False) -> None:
+        self.enabled = enabled or cprofile or trace_memory
+        self.cprofile = cprofile
+        self.tracemalloc = trace_memory
+        if trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def configure_from_env(self, variable: str = 'TRANSLATEX_PROFILE') -> None:
+        options = {o.strip() for o in os.environ.get(variable, '').lower().split(',') if o.strip()}
+        if not options or options & {'0', 'false', 'no', 'off'}:
+            return
+        self.configure(True, bool(options & {'cprofile', 'all'}), bool(options & {'tracemalloc', 'all'}))
+
+    def reset(self) -> None:
+        self.stages: dict[str, StageTimer] = {}
+        self.profiles: dict[str, list[cProfile.Profile]] = {}
+        self.snapshots: dict[str, tracemalloc.Snapshot] = {}
+        self._lock = threading.Lock()
+        # threads with a running cProfile, and whether some span owns the memory peak
+        self._profiled_threads: set[int] = set()
+        self._memory_owned = False
+
+    @contextmanager
+    def span(self, stage: str):
+        if not self.enabled:
+            yield
+            return
+        thread = threading.get_ident()
+        profile, owns_memory, memory_start = None, False, 0
+        with self._lock:
+            if self.cprofile and thread not in self._profiled_threads:
+                self._profiled_threads.add(thread)
+                profile = cProfile.Profile()
+            if self.tracemalloc and tracemalloc.is_tracing():
+                memory_start = tracemalloc.get_traced_memory()[0]
+                if not self._memory_owned:
+                    self._memory_owned = owns_memory = True
+                    tracemalloc.reset_peak()
+        if profile:
+            profile.enable()
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            if profile:
+                profile.disable()
+            with self._lock:
+                timer = self.stages.setdefault(stage, StageTimer())
+                timer.add(elapsed)
+                if profile:
+                    self._profiled_threads.discard(thread)
+                    self.profiles.setdefault(stage, []).append(profile)
+                if self.tracemalloc and tracemalloc.is_tracing():
+                    current, peak = tracemalloc.get_traced_memory()
+                    timer.allocated += current - memory_start
+                    if owns_memory:
+                        self._memory_owned = False
+                        timer.peak = max(timer.peak, peak)
+            if owns_memory:
+                self.snapshots[stage] = tracemalloc.take_snapshot()
+
+    def function_stats(self, stage: str) -> list[dict]:
+        profiles = self.profiles.get(stage)
+        if not profiles:
+            return []
+        stats = pstats.Stats(profiles[0])
+        for profile in profiles[1:]:
+            stats.add(profile)
+        rows = []
+        for (filename, line, function), (_, calls, tottime, cumtime, _) in stats.stats.items():
+            rows.append({
+                'function': f'{filename}:{line}({function})',
+                'calls': calls,
+                'tottime': round(tottime, 6),
+                'cumtime': round(cumtime, 6),
+            })
+        rows.sort(key=lambda r: r['cumtime'], reverse=True)
+        return rows[:top_entries]
+
+    def allocation_stats(self, stage: str) -> list[dict]:
+        snapshot = self.snapshots.get(stage)
+        if snapshot is None:
+            return []
+        return [
+            {'location': str(stat.traceback), 'size': stat.size, 'count': stat.count}
+            for stat in snapshot.statistics('lineno')[:top_entries]
+        ]
+
+    def report(self) -> dict:
+        return {
+            stage: {
+                'count': timer.count,
+                'total_seconds': round(timer.total, 6),
+                'max_seconds': round(timer.max, 6),
+                'allocated_bytes': timer.allocated if self.tracemalloc else None,
+                'peak_bytes': timer.peak if self.tracemalloc else None,
+                'functions': self.function_stats(stage),
+                'allocations': self.allocation_stats(stage),
+            }
+            for stage, timer in self.stages.items()
+        }
+
+    def dump(self, path: Path) -> None:
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.report(), f, indent=2)
+
+    def summary(self) -> str:
+        """A plain-text table of the stages, slowest first."""
+        lines = [f'{"stage":<20}{"spans":>7}{"total s":>10}{"max s":>10}' +
+                 (f'{"peak MiB":>10}' if self.tracemalloc else '')]
+        for stage, timer in sorted(self.stages.items(), key=lambda item: item[1].total, reverse=True):
+            line = f'{stage:<20}{timer.count:>7}{timer.total:>10.3f}{timer.max:>10.3f}'
+            if self.tracemalloc:
+                line += f'{timer.peak / 2 ** 20:>10.1f}'
+            lines.append(line)
+        return '\n'.join(lines)
+
+
+# shared by the whole process, disabled unless configured
+profiler = PipelineProfiler()
+profiler.configure_from_env()
@@ -0,0 +1,94 @@
+import time
+import asyncio
+from dataclasses import dataclass
+
+
+# buckets hold this many seconds worth of the per-minute limit, so requests are paced instead of sent in bursts
+burst_seconds = 10
+
+
+class TokenBucket:
+    """Refills `per_minute / 60` units per second, up to `burst_seconds` worth of units.
+    Waiting callers are served in FIFO order. Usage charged after the fact may drive the level
+    below zero, which delays the following callers."""
+
+    def __init__(self, per_minute: int) -> None:
+        self.rate = per_minute / 60
+        self.capacity = max(1.0, self.rate * burst_seconds)
+        self.level = self.capacity
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, amount: float) -> None:
+        # a single request larger than the bucket must not wait forever
+        amount = min(amount, self.capacity)
+        async with self.lock:
+            self._refill()
+            while self.level < amount:
+                await asyncio.sleep((amount - self.level) / self.rate)
+                self._refill()
+            self.level -= amount
+
+    def charge(self, amount: float) -> None:
+        self._refill()
+        self.level -= amount
+
+
+@dataclass
+class RateLimit:
+    rpm: int | None = None
+    tpm: int | None = None
+
+
+class RateLimiter:
+    """Paces requests below a requests-per-minute and a tokens-per-minute limit."""
+
+    def __init__(self, limit: RateLimit) -> None:
+        self.requests = TokenBucket(limit.rpm) if limit.rpm else None
+        self.tokens = TokenBucket(limit.tpm) if limit.tpm else None
+
+    async def acquire(self, prompt_tokens: int) -> None:
+        if self.requests:
+            await self.requests.acquire(1)
+        if self.tokens:
+            await self.tokens.acquire(prompt_tokens)
+
+    def record_completion(self, completion_tokens: int) -> None:
+        if self.tokens:
+            self.tokens.charge(completion_tokens)
+
+
+# (api_base, model) -> limit, either part may be None to match any value
+_rate_limits: dict[tuple[str | None, str | None], RateLimit] = {}
+# one limiter per configured limit, shared by every translator in the process
+_rate_limiters: dict[tuple[str | None, str | None], RateLimiter] = {}
+
+
+def set_rate_limit(rpm: int | None = None,
+                   tpm: int | None = None,
+                   model: str | None = None,
+                   api_base: str | None = None,
+                   ) -> None:
+    """Configure the limits of a model, of an API base or of a model at a specific API base.
+    Without any limit, the existing configuration for that key is removed."""
+    key = (api_base or None, model or None)
+    _rate_limiters.pop(key, None)
+    if rpm or tpm:
+        _rate_limits[key] = RateLimit(rpm=rpm, tpm=tpm)
+    else:
+        _rate_limits.pop(key, None)
+
+
+def get_rate_limiter(api_base: str | None, model: str | None) -> RateLimiter | None:
+    api_base, model = api_base or None, model or None
+    for key in ((api_base, model), (None, model), (api_base, None)):
+        if key in _rate_limits:
+            if key not in _rate_limiters:
+                _rate_limiters[key] = RateLimiter(_rate_limits[key])
+            return _rate_limiters[key]
+    return None
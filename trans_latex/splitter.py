@@ -1,4 +1,6 @@
 
+import re
+from bisect import bisect_left, bisect_right
 from typing import Iterable, Callable
 
 
@@ -28,17 +30,44 @@ latex_macro_separators = [
     " ",
 ]
 
-def _split(text: str, separator: str) -> list[str]:
-    """delimiter-preserving split operation"""
-    splits = text.split(separator)
-    if len(splits) > 1:
-        new_split = [splits[0]]
-        for split in splits[1:]:
-            new_split.append(separator + split)
-        splits = list(filter(lambda x: x != '', new_split))
-        return splits
-    else:
-        return splits
+
+class SeparatorIndex:
+    """Positions of all separators in a text, collected in a single scan.
+    Looking up the separators of a sub-range is a bisection, so recursive splits copy no substrings."""
+
+    def __init__(self, text: str, separators: list[str]) -> None:
+        self.separators = separators
+        self.positions: list[list[int]] = [[] for _ in separators]
+        alternatives = sorted({s for s in separators if s}, key=len, reverse=True)
+        if not alternatives:
+            return
+        # a zero-width lookahead finds overlapping occurrences, trying the longest alternative first
+        pattern = re.compile('(?=(' + '|'.join(map(re.escape, alternatives)) + '))')
+        # every separator occurring at a position is a prefix of the longest one matched there
+        levels_of = {
+            alt: [level for level, s in enumerate(separators) if s and alt.startswith(s)]
+            for alt in alternatives
+        }
+        for match in pattern.finditer(text):
+            pos = match.start()
+            for level in levels_of[match.group(1)]:
+                self.positions[level].append(pos)
+
+    def find(self, level: int, start: int, end: int) -> list[int]:
+        """Non-overlapping positions of a separator within text[start:end], as found by str.split"""
+        positions = self.positions[level]
+        length = len(self.separators[level])
+        lo = bisect_left(positions, start)
+        hi = bisect_right(positions, end - length)
+        if length == 1:
+            return positions[lo:hi]
+        results = []
+        next_allowed = start
+        for i in range(lo, hi):
+            if positions[i] >= next_allowed:
+                results.append(positions[i])
+                next_allowed = positions[i] + length
+        return results
 
 
 class LatexSourceSplitter:
@@ -50,10 +79,12 @@ class LatexSourceSplitter:
         chunk_size: int,
         length_function: Callable[[str], int],
         separators: list[str] = latex_macro_separators,
+        token_offsets_function: Callable[[str], list[int]] | None = None,
     ):
         self._chunk_size = chunk_size
         self._length_function = length_function
         self._separators = separators
+        self._token_offsets_function = token_offsets_function
     
     def merge_splits(self, splits: Iterable[str]) -> list[str]:
         # We now want to combine these smaller pieces into medium size chunks
@@ -74,33 +105,64 @@ class LatexSourceSplitter:
         return merged_splits
 
     def split_text(self, text: str) -> list[str]:
-        """Split incoming text and return chunks. Retain all separators."""
-        final_chunks = []
-        # Get appropriate separator to use
-        separator = self._separators[-1]
-        for _s in self._separators:
-            if _s in text:
-                try_split = _split(text, _s)
+        """Split incoming text and return chunks. Retain all separators.
+        Splits are handled as (start, end) offsets into `text`. With a token offsets function, the
+        text is tokenized only once and the length of a span is the number of tokens starting inside it."""
+        index = SeparatorIndex(text, self._separators)
+        if self._token_offsets_function is not None:
+            offsets = self._token_offsets_function(text)
+
+            def span_length(start: int, end: int) -> int:
+                return bisect_left(offsets, end) - bisect_left(offsets, start)
+        else:
+            def span_length(start: int, end: int) -> int:
+                return self._length_function(text[start:end])
+
+        spans = self._split_span(index, 0, len(text), span_length)
+        return [text[start:end] for start, end in spans]
+
+    def _merge_spans(self, spans: list[tuple[int, int, int]]) -> list[tuple[int, int]]:
+        merged_spans = []
+        current_start, current_end, current_len = spans[0][0], spans[0][0], 0
+        for start, end, new_len in spans:
+            if new_len + current_len > self._chunk_size:
+                merged_spans.append((current_start, current_end))
+                current_start, current_len = start, new_len
+            else:
+                current_len += new_len
+            current_end = end
+        merged_spans.append((current_start, current_end))
+        return merged_spans
+
+    def _split_span(self, index: SeparatorIndex, start: int, end: int,
+                    span_length: Callable[[int, int], int]) -> list[tuple[int, int]]:
+        splits = [(start, end)]
+        for level in range(len(self._separators)):
+            positions = index.find(level, start, end)
+            if positions:
+                bounds = [start] + positions + [end]
+                try_split = [(a, b) for a, b in zip(bounds, bounds[1:]) if a < b]
                 if len(try_split) > 1:
-                    separator = _s
+                    splits = try_split
                     break
-        splits = try_split
-        # Now go merging things, recursively splitting longer texts.
-        _good_splits = []
-        for s in splits:
-            if self._length_function(s) < self._chunk_size:
-                _good_splits.append(s)
+        final_spans = []
+        _good_spans = []
+        for split_start, split_end in splits:
+            split_len = span_length(split_start, split_end)
+            if split_len < self._chunk_size:
+                _good_spans.append((split_start, split_end, split_len))
             else:
-                if _good_splits:
-                    merged_text = self.merge_splits(_good_splits)
-                    final_chunks.extend(merged_text)
-                    _good_splits = []
-                other_info = self.split_text(s)
-                final_chunks.extend(other_info)
-        if _good_splits:
-            merged_text = self.merge_splits(_good_splits)
-            final_chunks.extend(merged_text)
-        return final_chunks
+                if _good_spans:
+                    final_spans.extend(self._merge_spans(_good_spans))
+                    _good_spans = []
+                if len(splits) == 1:
+                    # no separator left to split on, keep the oversized piece as it is
+                    final_spans.append((split_start, split_end))
+                else:
+                    final_spans.extend(self._split_span(index, split_start, split_end, span_length))
+        if _good_spans:
+            final_spans.extend(self._merge_spans(_good_spans))
+        return final_spans
 
 
 def test_splitter(test_str):
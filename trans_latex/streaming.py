@@ -0,0 +1,70 @@
+import asyncio
+
+
+class FencedTextFilter:
+    """Streaming counterpart of `LatexProjectTranslator.extract_translation`.
+    Passes through the text between the first pair of triple backticks as the deltas arrive.
+    Responses without any fence are held back and returned as a whole by `finish`. Unlike the
+    regex, a response with an unclosed fence keeps only the text after the fence."""
+
+    fence = '```'
+
+    def __init__(self) -> None:
+        self.buffer = ''
+        self.state = 'before'  # -> 'inside' -> 'after'
+
+    def feed(self, delta: str) -> str:
+        if self.state == 'after':
+            return ''
+        self.buffer += delta
+        if self.state == 'before':
+            pos = self.buffer.find(self.fence)
+            if pos < 0:
+                return ''
+            self.buffer = self.buffer[pos + len(self.fence):]
+            self.state = 'inside'
+        pos = self.buffer.find(self.fence)
+        if pos >= 0:
+            text, self.buffer, self.state = self.buffer[:pos], '', 'after'
+            return text
+        # hold back a trailing backtick or two, it may be the start of the closing fence
+        keep = len(self.buffer) - len(self.buffer.rstrip('`'))
+        text, self.buffer = self.buffer[:len(self.buffer) - keep], self.buffer[len(self.buffer) - keep:]
+        return text
+
+    def finish(self) -> str:
+        text, self.buffer = self.buffer.replace(self.fence, ''), ''
+        return text
+
+
+class OrderedChunkWriter:
+    """Appends the chunks of one output file in their original order while they are still streaming.
+    Text of the earliest unfinished chunk goes to the file right away, text of later chunks
+    is held back until every chunk before them is complete."""
+
+    def __init__(self, file) -> None:
+        self.file = file
+        self.next_index = 0
+        self.pending: dict[int, list[str]] = {}
+        self.finished: set[int] = set()
+        # writes go through a thread pool, the lock keeps them in order
+        self.lock = asyncio.Lock()
+
+    async def write(self, index: int, text: str) -> None:
+        async with self.lock:
+            if index == self.next_index:
+                await self.file.write(text)
+            else:
+                self.pending.setdefault(index, []).append(text)
+
+    async def finish(self, index: int) -> None:
+        async with self.lock:
+            self.finished.add(index)
+            while self.next_index in self.finished:
+                self.finished.remove(self.next_index)
+                self.next_index += 1
+                # the next chunk may have streamed some text already
+                buffered = self.pending.pop(self.next_index, None)
+                if buffered:
+                    await self.file.write(''.join(buffered))
+            await self.file.flush()
@@ -0,0 +1,175 @@
+"""Timing and token counts of every LLM request of a run, written as a JSON report and in the
+Prometheus textfile format (for the textfile collector of node_exporter)."""
+import os
+import json
+import time
+from collections import Counter
+from dataclasses import dataclass, asdict
+from pathlib import Path
+
+from trans_latex.llm import cached_prompt_tokens
+
+
+report_filename = 'translatex-report.json'
+# metrics of the run in the Prometheus textfile format, next to the report
+metrics_filename = 'translatex-metrics.prom'
+latency_quantiles = (0.5, 0.9, 0.99)
+
+
+@dataclass
+class RequestMetrics:
+    # source file and index of the chunk the request translates
+    source: str | None
+    chunk: int
+    # 'request', 'stream', 'batch', or 'fallback' for the unmasked retry of a masked chunk
+    kind: str = 'request'
+    # waiting for a request slot and for the client-side rate limit
+    queue_wait: float = 0.0
+    # streamed requests only
+    time_to_first_token: float | None = None
+    # from sending the request to the end of the response, retries included
+    latency: float = 0.0
+    retries: int = 0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    cached_tokens: int = 0
+    finish_reason: str | None = None
+    error: str | None = None
+
+    @property
+    def failed(self) -> bool:
+        return self.error is not None
+
+    @property
+    def truncated(self) -> bool:
+        return self.finish_reason == 'length'
+
+    def record_response(self, response) -> None:
+        usage = getattr(response, 'usage', None)
+        self.prompt_tokens = getattr(usage, 'prompt_tokens', 0) or 0
+        self.completion_tokens = getattr(usage, 'completion_tokens', 0) or 0
+        self.cached_tokens = cached_prompt_tokens(usage)
+        choices = getattr(response, 'choices', None)
+        self.finish_reason = choices[0].finish_reason if choices else None
+
+
+def _quantile(values: list[float], q: float) -> float | None:
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, round(q * (len(values) - 1)))]
+
+
+class RunTelemetry:
+    """Requests and chunk outcomes of one or more translated projects."""
+
+    def __init__(self, model: str, chunk_size: int | None = None) -> None:
+        self.model = model
+        self.chunk_size = chunk_size
+        self.started = time.time()
+        self.finished: float | None = None
+        self.requests: list[RequestMetrics] = []
+        # 'requested', 'cached', 'reused', 'batch' or 'journal' per chunk
+        self.chunks = Counter()
+
+    def finish(self) -> None:
+        self.finished = time.time()
+
+    @property
+    def duration(self) -> float:
+        return (self.finished or time.time()) - self.started
+
+    def extend(self, other: 'RunTelemetry') -> None:
+        self.requests.extend(other.requests)
+        self.chunks.update(other.chunks)
+
+    def summary(self) -> dict:
+        timed = [r for r in self.requests if r.kind != 'batch' and not r.failed]
+        latencies = [r.latency for r in timed]
+        ttfts = [r.time_to_first_token for r in timed if r.time_to_first_token is not None]
+        completion_tokens = sum(r.completion_tokens for r in self.requests)
+        return {
+            'chunks': dict(self.chunks),
+            'requests': len(self.requests),
+            'failed_requests': sum(r.failed for r in self.requests),
+            'truncated_requests': sum(r.truncated for r in self.requests),
+            'retries': sum(r.retries for r in self.requests),
+            'prompt_tokens': sum(r.prompt_tokens for r in self.requests),
+            'completion_tokens': completion_tokens,
+            'cached_tokens': sum(r.cached_tokens for r in self.requests),
+            'queue_wait_seconds': round(sum(r.queue_wait for r in self.requests), 3),
+            'latency_seconds': {f'p{round(q * 100)}': _quantile(latencies, q) for q in latency_quantiles},
+            'time_to_first_token_seconds': {f'p{round(q * 100)}': _quantile(ttfts, q) for q in latency_quantiles},
+            'completion_tokens_per_second': round(completion_tokens / self.duration, 2) if self.duration else None,
+        }
+
+    def report(self) -> dict:
+        return {
+            'model': self.model,
+            'chunk_size': self.chunk_size,
+            'started': self.started,
+            'finished': self.finished,
+            'duration': round(self.duration, 3),
+            'summary': self.summary(),
+            'requests': [asdict(r) for r in self.requests],
+        }
+
+    def write_json(self, path: Path) -> None:
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.report(), f, ensure_ascii=False, indent=2)
+
+    def prometheus_text(self) -> str:
+        """Gauges of the latest run, the textfile is overwritten by every run."""
+        labels = f'model="{self.model}"'
+        summary = self.summary()
+        lines = []
+
+        def metric(name: str, kind: str, help_text: str, samples: list[tuple[str, float | None]]) -> None:
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+            for extra_labels, value in samples:
+                if value is None:
+                    continue
+                all_labels = labels + (',' + extra_labels if extra_labels else '')
+                lines.append(f'{name}{{{all_labels}}} {value}')
+
+        metric('translatex_run_timestamp_seconds', 'gauge', 'When the latest run finished.',
+               [('', round(self.finished or time.time(), 3))])
+        metric('translatex_run_duration_seconds', 'gauge', 'Wall time of the latest run.',
+               [('', round(self.duration, 3))])
+        metric('translatex_chunks', 'gauge', 'Chunks of the latest run by outcome.',
+               [(f'outcome="{outcome}"', n) for outcome, n in sorted(self.chunks.items())])
+        requests = Counter((r.kind, 'failed' if r.failed else 'ok') for r in self.requests)
+        metric('translatex_requests', 'gauge', 'LLM requests of the latest run.',
+               [(f'kind="{kind}",status="{status}"', n) for (kind, status), n in sorted(requests.items())])
+        metric('translatex_retries', 'gauge', 'Retried LLM requests of the latest run.', [('', summary['retries'])])
+        metric('translatex_truncated_requests', 'gauge', 'Responses cut at the output limit of the model.',
+               [('', summary['truncated_requests'])])
+        metric('translatex_tokens', 'gauge', 'Tokens of the latest run.', [
+            ('type="prompt"', summary['prompt_tokens']),
+            ('type="completion"', summary['completion_tokens']),
+            ('type="cached"', summary['cached_tokens']),
+        ])
+        metric('translatex_queue_wait_seconds', 'gauge', 'Time requests waited for a slot and the rate limit.',
+               [('', summary['queue_wait_seconds'])])
+        metric('translatex_completion_tokens_per_second', 'gauge', 'Completion tokens over the run wall time.',
+               [('', summary['completion_tokens_per_second'])])
+        timed = [r for r in self.requests if r.kind != 'batch' and not r.failed]
+        for name, values, help_text in (
+            ('translatex_request_latency_seconds', [r.latency for r in timed], 'Latency of LLM requests.'),
+            ('translatex_time_to_first_token_seconds',
+             [r.time_to_first_token for r in timed if r.time_to_first_token is not None],
+             'Time to the first streamed token.'),
+        ):
+            metric(name, 'summary', help_text,
+                   [(f'quantile="{q}"', _quantile(values, q)) for q in latency_quantiles])
+            lines.append(f'{name}_sum{{{labels}}} {round(sum(values), 3)}')
+            lines.append(f'{name}_count{{{labels}}} {len(values)}')
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus(self, path: Path) -> None:
+        # replaced atomically, the collector must never read a half-written file
+        path.parent.mkdir(parents=True, exist_ok=True)
+        temp_path = path.with_name(path.name + '.tmp')
+        temp_path.write_text(self.prometheus_text(), encoding='utf-8')
+        os.replace(temp_path, path)
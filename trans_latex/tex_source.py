@@ -1,9 +1,18 @@
 
 import os
+import re
+import time
+import pickle
+import asyncio
+import hashlib
 from pathlib import Path
+from dataclasses import dataclass, field
 import aiofiles
+import pylatexenc
+from pylatexenc.macrospec import MacroSpec
 from pylatexenc.latexwalker import (
     LatexWalker,
+    get_default_latex_context_db,
     LatexNode,
     LatexCharsNode,
     LatexCommentNode,
@@ -13,21 +22,261 @@ from pylatexenc.latexwalker import (
     LatexMathNode,
 )
 
+from trans_latex.profiling import profiler
+
+
+default_parse_cache_dir = Path('~/.cache/translatex/parsed').expanduser()
+
+# the default context does not know the include macros of the subfiles and import packages,
+# their arguments would end up as separate group nodes
+latex_context = get_default_latex_context_db()
+latex_context.add_context_category('translatex-includes', prepend=True, macros=[
+    MacroSpec('subfile', '{'),
+    MacroSpec('import', '{{'),
+    MacroSpec('inputfrom', '{{'),
+    MacroSpec('includefrom', '{{'),
+    MacroSpec('subimport', '*{{'),
+    MacroSpec('subinputfrom', '*{{'),
+    MacroSpec('subincludefrom', '*{{'),
+])
+# reference macros unknown to the default context, their arguments belong to them when masking
+latex_context.add_context_category('translatex-references', prepend=True, macros=[
+    MacroSpec('pageref', '*{'),
+    MacroSpec('nocite', '{'),
+    MacroSpec('citealp', '*[[{'),
+    MacroSpec('citealt', '*[[{'),
+])
+# bump whenever `latex_context` changes, cached pickles are parsed with the old one
+parse_format = 3
+
+
+def parse_latex_content(content: str) -> list[LatexNode]:
+    with profiler.span('parse'):
+        walker = LatexWalker(content, latex_context=latex_context)
+        node_list, _, _ = walker.get_latex_nodes()
+    return node_list
+
+
+def is_private(path: Path) -> bool:
+    """Whether `path` is no symlink, owned by the current user and writable by nobody else."""
+    if not hasattr(os, 'getuid'):
+        # Windows, the cache is in the profile directory of the user
+        return True
+    st = os.lstat(path)
+    return not os.path.islink(path) and st.st_uid == os.getuid() and not st.st_mode & 0o022
+
+
+class LatexParseCache:
+    """Parsed node lists by file content, so no file is parsed twice in a session.
+    Unchanged files (same mtime and size) are not even read again. With a `cache_dir`, node lists
+    are also pickled to disk, making a reopened project or arXiv download load without parsing.
+    Loading a pickle can run code, so the directory and every pickle must be private to the user.
+    Callers share the cached node lists and must not modify them."""
+
+    def __init__(self, cache_dir: Path | None = default_parse_cache_dir, max_disk_bytes: int = 128 * 1024 * 1024) -> None:
+        self.cache_dir = cache_dir
+        # path -> ((mtime_ns, size), content digest)
+        self.stats: dict[str, tuple[tuple[int, int], str]] = {}
+        # content digest -> node list
+        self.nodes: dict[str, list[LatexNode]] = {}
+        self.parsed = 0
+        self.hits = 0
+        if cache_dir is not None:
+            cache_dir.mkdir(mode=0o700, parents=True, exist_ok=True)
+            if is_private(cache_dir):
+                self.prune(max_disk_bytes)
+            else:
+                print(f'{cache_dir} is writable by other users, parsed files are not cached on disk')
+                self.cache_dir = None
+
+    @staticmethod
+    def digest(content: str) -> str:
+        # pickles of another pylatexenc version may not match the installed classes
+        key = f'{pylatexenc.__version__}\0{parse_format}\0{content}'
+        return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+    def prune(self, max_disk_bytes: int) -> None:
+        """Drop the least recently written pickles beyond `max_disk_bytes`."""
+        files = sorted(self.cache_dir.glob('*.pickle'), key=lambda p: p.stat().st_mtime, reverse=True)
+        total = 0
+        for path in files:
+            total += path.stat().st_size
+            if total > max_disk_bytes:
+                path.unlink(missing_ok=True)
+
+    def _load_pickle(self, digest: str) -> list[LatexNode] | None:
+        if self.cache_dir is None:
+            return None
+        path = self.cache_dir / f'{digest}.pickle'
+        if not path.exists():
+            return None
+        if not is_private(path):
+            # not written by this user, never unpickled
+            return None
+        try:
+            with open(path, 'rb') as f:
+                return pickle.load(f)
+        except Exception:
+            path.unlink(missing_ok=True)
+            return None
+
+    def _save_pickle(self, digest: str, node_list: list[LatexNode]) -> None:
+        if self.cache_dir is None:
+            return
+        path = self.cache_dir / f'{digest}.pickle'
+        try:
+            data = pickle.dumps(node_list, protocol=pickle.HIGHEST_PROTOCOL)
+        except (pickle.PicklingError, RecursionError, TypeError):
+            # deeply nested documents, keep them in memory only
+            return
+        # write then rename, a concurrent reader never sees a partial file
+        temp_path = path.with_suffix(f'.{os.getpid()}.tmp')
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+        os.replace(temp_path, path)
+
+    async def parse(self, file_path) -> list[LatexNode]:
+        file_path = os.path.abspath(file_path)
+        stat = os.stat(file_path)
+        fingerprint = (stat.st_mtime_ns, stat.st_size)
+        known = self.stats.get(file_path)
+        if known and known[0] == fingerprint and known[1] in self.nodes:
+            self.hits += 1
+            return self.nodes[known[1]]
+
+        async with aiofiles.open(file_path, 'r', encoding='utf-8') as f:
+            content = await f.read()
+        digest = self.digest(content)
+        self.stats[file_path] = (fingerprint, digest)
+        if digest in self.nodes:
+            self.hits += 1
+            return self.nodes[digest]
+
+        node_list = self._load_pickle(digest)
+        if node_list is not None:
+            self.hits += 1
+        else:
+            # in a thread, so loading a large file does not block the event loop
+            node_list = await asyncio.to_thread(parse_latex_content, content)
+            self.parsed += 1
+            self._save_pickle(digest, node_list)
+        self.nodes[digest] = node_list
+        return node_list
+
+
+_parse_cache: LatexParseCache | None = None
+
+
+def get_parse_cache() -> LatexParseCache:
+    """The cache shared by every loader in the process. Created on the first parse, so that
+    importing this module neither creates nor prunes the cache directory."""
+    global _parse_cache
+    if _parse_cache is None:
+        _parse_cache = LatexParseCache()
+    return _parse_cache
+
+
+# an escaped character is kept, so `\\%` still starts a comment while `\%` does not
+_comment_pattern = re.compile(r'(\\.)|%[^\n]*', re.DOTALL)
+_begin_document_pattern = re.compile(r'\\begin\s*\{document\}')
+_end_document_pattern = re.compile(r'\\end\s*\{document\}')
+_documentclass_pattern = re.compile(r'\\documentclass\b')
+# file names that usually hold the main document, used to break ties
+common_main_names = ('main.tex', 'ms.tex', 'paper.tex', 'article.tex', 'manuscript.tex')
+
+
+# include macro -> whether its first argument is a directory, and whether that directory
+# is relative to the including file (sub*) rather than to the project root
+include_macros = {
+    'input': (False, False),
+    'include': (False, False),
+    'subfile': (False, False),
+    'import': (True, False),
+    'inputfrom': (True, False),
+    'includefrom': (True, False),
+    'subimport': (True, True),
+    'subinputfrom': (True, True),
+    'subincludefrom': (True, True),
+}
+
+
+@dataclass
+class IncludeGraph:
+    """Which source includes which, in document order. Paths are relative to the project directory."""
+    root: str
+    edges: dict[str, list[str]] = field(default_factory=dict)
+    # (including source, include argument) pairs that did not resolve to a file in the project
+    missing: list[tuple[str, str]] = field(default_factory=list)
+
+    def order(self) -> list[str]:
+        """Sources in depth-first document order, each once."""
+        visited, order, stack = set(), [], [self.root]
+        while stack:
+            source = stack.pop()
+            if source in visited:
+                continue
+            visited.add(source)
+            order.append(source)
+            stack.extend(reversed(self.edges.get(source, [])))
+        return order
+
+    def cycles(self) -> list[list[str]]:
+        cycles, done, path = [], set(), []
+
+        def visit(source: str) -> None:
+            path.append(source)
+            for child in self.edges.get(source, []):
+                if child in path:
+                    cycles.append(path[path.index(child):] + [child])
+                elif child not in done:
+                    visit(child)
+            path.pop()
+            done.add(source)
+
+        visit(self.root)
+        return cycles
+
+    def warnings(self) -> list[str]:
+        warnings = [f'{source}: included file "{name}" is not found' for source, name in self.missing]
+        warnings += ['Include cycle: ' + ' -> '.join(cycle) for cycle in self.cycles()]
+        return warnings
+
+
+def strip_comments(content: str) -> str:
+    return _comment_pattern.sub(lambda m: m.group(1) or '', content)
+
+
+def rank_main_candidate(name: str, content: str) -> tuple | None:
+    """Sort key of a possible main source, lower is better. None if there is no `\\begin{document}` outside comments."""
+    content = strip_comments(content)
+    begin = _begin_document_pattern.search(content)
+    if begin is None:
+        return None
+    documentclass = _documentclass_pattern.search(content, 0, begin.start())
+    end = _end_document_pattern.search(content, begin.end())
+    return (
+        documentclass is None,
+        end is None,
+        name.lower() not in common_main_names,
+        name,
+    )
+
 
 class LatexSourcesLoader:
 
-    def __init__(self, project_dir: Path, main: str | None = None) -> None:
+    def __init__(self, project_dir: Path, main: str | None = None, cache: LatexParseCache | None = None) -> None:
         self.project_dir: Path = project_dir
         self.main_source: str | None = main
         self.sources: dict[str, list[LatexNode]] = {}
+        # None uses the shared cache of the process
+        self.cache: LatexParseCache | None = cache
+        self.load_time: float = 0.0
+        self.include_graph: IncludeGraph | None = None
+        self.warnings: list[str] = []
     
     @staticmethod
-    async def parse_latex_file(file_path) -> list[LatexNode]:
-        async with aiofiles.open(file_path, 'r', encoding='utf-8') as f:
-            content = await f.read()
-        walker = LatexWalker(content)
-        node_list, _, _ = walker.get_latex_nodes()
-        return node_list
+    async def parse_latex_file(file_path, cache: LatexParseCache | None = None) -> list[LatexNode]:
+        return await (cache or get_parse_cache()).parse(file_path)
     
     @staticmethod
     def get_text_from_nodes(node_list: list[LatexNode]) -> str:
@@ -42,8 +291,8 @@ class LatexSourcesLoader:
         return ''.join(texts)
     
     @staticmethod
-    async def contains_environment(path, environment: str) -> bool:
-        node_list = await LatexSourcesLoader.parse_latex_file(path)
+    async def contains_environment(path, environment: str, cache: LatexParseCache | None = None) -> bool:
+        node_list = await LatexSourcesLoader.parse_latex_file(path, cache)
         for node in node_list:
             if LatexSourcesLoader.find_env_node(node, environment):
                     return True
@@ -83,37 +332,118 @@ class LatexSourcesLoader:
         return results
     
     async def find_document_environment(self) -> None:
+        """Ranks the top-level .tex files by a lexical scan, then fully parses candidates in that order
+        and takes the first one that really contains a "document" environment."""
         print(f'No main source file specified. Looking for "document" latex environment in {self.project_dir} ...')
+        candidates = []
         for n in os.listdir(self.project_dir):
             file_path = os.path.join(self.project_dir, n)
             if os.path.isfile(file_path) and file_path.split('.')[-1] == 'tex':
-                if await self.contains_environment(file_path, 'document'):
-                    self.main_source = n
-
-    async def _load_includes(self, node_list: list[LatexNode]) -> None:
-        """recursively load sources"""
-        input_nodes = self.find_macro_nodes(node_list, 'input')
-        for inode in input_nodes:
-            # print(inode.latex_verbatim())
-            # input macro -> first arg -> first node -> text
-            filename = inode.nodeargd.argnlist[0].nodelist[0].chars
-            if not filename.endswith('.tex'):
-                filename = filename + '.tex'
-            filepath = os.path.join(self.project_dir, filename)
-            assert os.path.exists(filepath)
-            if self.sources.get(filename) is None:
-                new_nodes = await self.parse_latex_file(filepath)
-                self.sources[filename] = new_nodes
-                await self._load_includes(new_nodes)
+                async with aiofiles.open(file_path, 'r', encoding='utf-8', errors='replace') as f:
+                    rank = rank_main_candidate(n, await f.read())
+                if rank is not None:
+                    candidates.append(rank)
+
+        for rank in sorted(candidates):
+            name = rank[-1]
+            if await self.contains_environment(os.path.join(self.project_dir, name), 'document', self.cache):
+                self.main_source = name
+                return
+
+    @staticmethod
+    def find_include_nodes(node_list: list[LatexNode]) -> list[tuple[str, str, str]]:
+        """(macro name, directory argument, file argument) of every include macro, also inside groups,
+        environments and arguments of other macros."""
+        includes = []
+        for i, node in enumerate(node_list):
+            if node is None:
+                continue
+            if isinstance(node, LatexMacroNode) and node.macroname in include_macros:
+                args = [a for a in (node.nodeargd.argnlist if node.nodeargd else []) if a is not None]
+                args = [a for a in args if a.latex_verbatim() != '*']
+                if not args:
+                    continue
+                if isinstance(args[-1], LatexGroupNode):
+                    name = ''.join(n.latex_verbatim() for n in args[-1].nodelist)
+                else:
+                    # `\input file` without braces, the parser only takes the first character
+                    name = args[-1].latex_verbatim()
+                    following = node_list[i + 1] if i + 1 < len(node_list) else None
+                    if isinstance(following, LatexCharsNode):
+                        name += re.match(r'\S*', following.chars).group()
+                directory = ''
+                if include_macros[node.macroname][0] and len(args) > 1 and isinstance(args[0], LatexGroupNode):
+                    directory = ''.join(n.latex_verbatim() for n in args[0].nodelist)
+                includes.append((node.macroname, directory.strip(), name.strip()))
+            elif isinstance(node, LatexMacroNode):
+                if node.nodeargd:
+                    includes += LatexSourcesLoader.find_include_nodes(node.nodeargd.argnlist)
+            elif isinstance(node, (LatexGroupNode, LatexEnvironmentNode)):
+                includes += LatexSourcesLoader.find_include_nodes(node.nodelist)
+        return includes
+
+    def resolve_include(self, name: str, base_dir: str) -> str | None:
+        """Path of an included file relative to the project directory, looked up in `base_dir` and then
+        in the project root, the way LaTeX looks it up in the working directory. None if not found."""
+        for directory in dict.fromkeys([base_dir, '']):
+            path = os.path.normpath(os.path.join(directory, name))
+            if path.startswith('..') or os.path.isabs(path):
+                continue
+            for candidate in (path + '.tex', path) if not path.endswith('.tex') else (path,):
+                if os.path.isfile(os.path.join(self.project_dir, candidate)):
+                    return Path(candidate).as_posix()
+        return None
+
+    async def _load_includes(self, source: str, node_list: list[LatexNode], base_dir: str) -> None:
+        """Loads the files included by `source`, independent branches concurrently."""
+        children = []
+        edges = self.include_graph.edges.setdefault(source, [])
+        with profiler.span('include_resolution'):
+            for macro, directory, name in self.find_include_nodes(node_list):
+                has_directory, relative_to_file = include_macros[macro]
+                lookup_dir = base_dir
+                if has_directory:
+                    lookup_dir = os.path.normpath(os.path.join(base_dir if relative_to_file else '', directory))
+                filename = self.resolve_include(name, lookup_dir)
+                if filename is None:
+                    self.include_graph.missing.append((source, os.path.join(directory, name)))
+                    continue
+                if not filename.endswith('.tex'):
+                    # figures and listings pulled in with \input are not translated
+                    continue
+                edges.append(filename)
+                if filename in self._seen_sources:
+                    continue
+                self._seen_sources.add(filename)
+                children.append(self._load_source(filename, lookup_dir if has_directory else base_dir))
+        await asyncio.gather(*children)
+
+    async def _load_source(self, filename: str, base_dir: str) -> None:
+        node_list = await self.parse_latex_file(os.path.join(self.project_dir, filename), self.cache)
+        self.sources[filename] = node_list
+        await self._load_includes(filename, node_list, base_dir)
     
+    def translated_sources(self) -> list[str]:
+        """Sources the translator overwrites in the output directory, the main source goes to a new file."""
+        return [source for source in self.sources if source != self.main_source]
+
     async def load_sources(self) -> dict[str, list[LatexNode]]:
+        started = time.perf_counter()
+        try:
+            with profiler.span('load'):
+                return await self._load_sources()
+        finally:
+            self.load_time = time.perf_counter() - started
+
+    async def _load_sources(self) -> dict[str, list[LatexNode]]:
         if self.main_source is None:
-            await self.find_document_environment()
+            with profiler.span('detect_main'):
+                await self.find_document_environment()
         if self.main_source is None or not os.path.exists(os.path.join(self.project_dir, self.main_source)):
             # raise ValueError('Main document source is not found.')
             return self.sources
         
-        nodes_main = await self.parse_latex_file(os.path.join(self.project_dir, self.main_source))
+        nodes_main = await self.parse_latex_file(os.path.join(self.project_dir, self.main_source), self.cache)
         self.sources[self.main_source] = nodes_main
 
         document_env_node = None
@@ -122,6 +452,15 @@ class LatexSourcesLoader:
             if document_env_node:
                 break
         
+        # files included in the preamble hold definitions, not text to translate
         document_nodes: list[LatexNode] = document_env_node.nodelist
-        await self._load_includes(document_nodes)
+        self.include_graph = IncludeGraph(self.main_source)
+        self._seen_sources = {self.main_source}
+        await self._load_includes(self.main_source, document_nodes, os.path.dirname(self.main_source))
+
+        # branches finish in any order, keep the sources in document order
+        self.sources = {source: self.sources[source] for source in self.include_graph.order()}
+        self.warnings = self.include_graph.warnings()
+        for warning in self.warnings:
+            print(f'Warning: {warning}')
         return self.sources
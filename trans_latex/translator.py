@@ -1,12 +1,45 @@
 
 import re
+import time
+import asyncio
 from pathlib import Path
+from contextlib import asynccontextmanager
 import aiofiles
 
 from trans_latex.tex_source import LatexSourcesLoader
 from trans_latex.splitter import LatexSourceSplitter
 from trans_latex.chat_prompt import ChatPromptTemplate
-from trans_latex.llm import LLMServiceConfig, async_chat_completion, count_tokens
+from trans_latex.llm import (
+    LLMServiceConfig,
+    LLMClient,
+    load_litellm,
+    get_llm_client,
+    record_completion_tokens,
+    count_tokens,
+    token_offsets,
+    needs_cache_markers,
+    prompt_cache_discount,
+)
+from trans_latex.cache import TranslationCache
+from trans_latex.incremental import PreviousTranslation, manifest_filename
+from trans_latex.streaming import FencedTextFilter, OrderedChunkWriter
+from trans_latex.plan import WorkEstimate, PlannedChunk, PlannedFile, TranslationPlan
+from trans_latex.masking import find_maskable_spans, mask_chunks, unmask
+from trans_latex.chunk_size import chunk_size_limit, chunk_size_tuner
+from trans_latex.telemetry import RequestMetrics, RunTelemetry, report_filename, metrics_filename
+from trans_latex.profiling import profiler
+from trans_latex.journal import JobJournal, journal_filename
+
+
+class TranslationAborted(Exception):
+    """Raised instead of sending a request once a request of the same job has failed for good."""
+
+
+def first_error(results: list) -> BaseException | None:
+    """The error that failed a job, rather than those of the chunks it aborted."""
+    errors = [r for r in results if isinstance(r, BaseException)]
+    causes = [e for e in errors if not isinstance(e, TranslationAborted)]
+    return (causes or errors or [None])[0]
 
 
 class LatexProjectTranslator:
@@ -15,123 +48,455 @@ class LatexProjectTranslator:
     def __init__(self,
                  source: LatexSourcesLoader,
                  template: ChatPromptTemplate,
-                 api_config: LLMServiceConfig,
-                 chunk_size: int,
+                 api_config: LLMServiceConfig | None,
+                 chunk_size: int | None,
+                 max_concurrency: int = 1,
+                 cache: TranslationCache | None = None,
+                 previous: PreviousTranslation | None = None,
+                 stream: bool = False,
+                 plan: TranslationPlan | None = None,
+                 mask: bool = False,
                  ) -> None:
         self.source = source
         self.template = template
         self.api_config = api_config
-        self.splitter = LatexSourceSplitter(chunk_size=chunk_size, length_function=lambda t: count_tokens(text=t))
-        self.translation_responses = None
+        # without a service config, e.g. no API key yet, the work is estimated with the default tokenizer
+        self.model = api_config.model if api_config else ''
+        # chunks must fit the model along with the prompt and the translation
+        self.chunk_size_limit = chunk_size_limit(
+            self.model, count_tokens(messages=template.prefix_messages(), model=self.model)
+        )
+        # None picks the size tuned by earlier runs with this model
+        self.auto_chunk_size = chunk_size is None
+        if chunk_size is None:
+            chunk_size = chunk_size_tuner.suggest(self.model, self.chunk_size_limit)
+        self.set_chunk_size(chunk_size)
+        self.cache = cache
+        self.previous = previous
+        # write streamed responses to the output files as they arrive
+        self.stream = stream
+        # made by the cost estimation, or by `translate_project` if there is none
+        self.plan = plan
+        # send formulas and references as placeholders, put them back in the translation
+        self.mask = mask
+        # mark the static prompt prefix for providers that cache it on request only, changing the
+        # messages (and the cache keys) for providers that cache on their own would gain nothing
+        self.cache_prefix = needs_cache_markers(self.model)
+        # bounds the number of in-flight requests across all chunks and files
+        self.request_semaphore = asyncio.Semaphore(max_concurrency)
+        self.max_concurrency = max_concurrency
+        # a request failed after all retries, the requests still waiting for a slot are not sent
+        self.aborted = False
+        # sources with a request sent, see `update_ongoing_file_cb`
+        self.started_files: set[str | None] = set()
         self.translated_chunks = None
+        self.received_tokens = None
+        self.reused_chunks = None
+        # masked chunks whose placeholders did not survive the translation
+        self.mask_failures = None
+        # chat completion bodies by cache key, fetched through the Batch API
+        self.batch_results: dict[str, dict] = {}
+        # timing and tokens of every request of the latest run, also tune the chunk size of the next run
+        self.telemetry: RunTelemetry | None = None
+        self.chunk_records: dict[str, list[tuple[str, str]]] | None = None
+        # chunks received so far by the job in the output directory, kept across crashes
+        self.journal: JobJournal | None = None
+        self.journaled_chunks = None
         self.update_ongoing_file_cb = None
         self.complete_chunk_cb = None
-    
-    async def translate(self, text: str) -> str:
-        text_chunks = self.splitter.split_text(text)
-        translated_chunks = []
-        for chunk in text_chunks:
-            response = await async_chat_completion(
-                self.api_config,
-                self.template.create_messages(chunk)
-            )
-            self.translated_chunks += 1
-            if self.complete_chunk_cb:
-                self.complete_chunk_cb()
-            self.translation_responses.append(response)
-            translated_txt = response.choices[0].message.content
-            match = re.search(self.triple_backticks_pattern, translated_txt, re.DOTALL)
-            if match:
-                translated_chunks.append(match.group(1).replace('```', ''))
+        self.receive_tokens_cb = None
+
+    def extract_translation(self, translated_txt: str) -> str:
+        match = re.search(self.triple_backticks_pattern, translated_txt, re.DOTALL)
+        if match:
+            return match.group(1).replace('```', '')
+        else:
+            return translated_txt.replace('```', '')
+
+    @property
+    def llm_client(self) -> LLMClient:
+        """Created on the first request, estimating the work needs no service config."""
+        return get_llm_client(self.api_config, max_connections=self.max_concurrency)
+
+    def set_chunk_size(self, chunk_size: int) -> None:
+        self.chunk_size = chunk_size
+        model = self.model
+        self.splitter = LatexSourceSplitter(
+            chunk_size=chunk_size,
+            length_function=lambda t: count_tokens(text=t, model=model),
+            token_offsets_function=lambda t: token_offsets(t, model=model),
+        )
+
+    def split_source(self, source: str, text: str) -> list[tuple[str, str | None]]:
+        """Split the text of a source file into chunks, paired with the reusable translation if any."""
+        if self.previous:
+            return self.previous.plan_chunks(source, text, self.splitter)
+        return [(chunk, None) for chunk in self.splitter.split_text(text)]
+
+    def plan_file(self,
+                  source: str | None,
+                  text: str,
+                  output: str | None = None,
+                  prefix: str = '',
+                  suffix: str = '',
+                  spans: list[tuple[int, int]] | None = None,
+                  ) -> PlannedFile:
+        """`spans` are the maskable spans of `text`, see `find_maskable_spans`."""
+        with profiler.span('split'):
+            split = self.split_source(source, text)
+        masked_chunks = None
+        # spans are offsets into the text, only usable if the chunks cover it exactly
+        if self.mask and spans and ''.join(chunk for chunk, _ in split) == text:
+            masked_chunks = mask_chunks([chunk for chunk, _ in split], spans)
+        with profiler.span('estimate'):
+            chunks = []
+            for i, (chunk, reused) in enumerate(split):
+                planned = PlannedChunk(chunk, reused)
+                if reused is None:
+                    prompt_text = chunk
+                    if masked_chunks and masked_chunks[i].originals:
+                        prompt_text = masked_chunks[i].text
+                        planned.placeholders = masked_chunks[i].originals
+                    planned.messages = self.template.create_messages(
+                        prompt_text, masked=bool(planned.placeholders), cacheable=self.cache_prefix
+                    )
+                    planned.prompt_tokens = count_tokens(messages=planned.messages, model=self.model)
+                    planned.completion_tokens = count_tokens(text=prompt_text, model=self.model)
+                    if planned.placeholders:
+                        planned.saved_tokens = count_tokens(text=chunk, model=self.model) - planned.completion_tokens
+                    # also the custom ID of the request in Batch API mode
+                    if self.api_config:
+                        planned.cache_key = TranslationCache.make_key(self.api_config, planned.messages)
+                    if self.cache and planned.cache_key:
+                        planned.cached = self.cache.contains(planned.cache_key)
+                chunks.append(planned)
+        return PlannedFile(source, output or source, chunks, prefix, suffix)
+
+    def new_plan(self) -> TranslationPlan:
+        return TranslationPlan(
+            self.model,
+            self.chunk_size,
+            self.template,
+            self.mask,
+            prefix_tokens=count_tokens(messages=self.template.prefix_messages(), model=self.model),
+            cache_discount=prompt_cache_discount(self.model),
+        )
+
+    def build_plan(self) -> TranslationPlan:
+        plan = self.new_plan()
+
+        # translate latex text within \begin{document} \end{document}
+        with profiler.span('text_extraction'):
+            document_nodes = None
+            text_before_document_env, text_after_document_env = '', '\n\\end{document}'
+            for node in self.source.sources[self.source.main_source]:
+                document_node = LatexSourcesLoader.find_env_node(node, 'document')
+                if document_node:
+                    document_nodes = document_node.nodelist
+                    continue
+                if document_nodes is None:
+                    text_before_document_env += node.latex_verbatim()
+                else:
+                    text_after_document_env += node.latex_verbatim()
+            text_before_document_env += '\n\\begin{document}\n'
+            main_text, main_spans = self.source.get_text_from_nodes(document_nodes), find_maskable_spans(document_nodes)
+        plan.files.append(self.plan_file(
+            self.source.main_source,
+            main_text,
+            'translated_main.tex',
+            text_before_document_env,
+            text_after_document_env,
+            spans=main_spans,
+        ))
+
+        for source in self.source.sources.keys():
+            if source == self.source.main_source:
+                continue
+            nodes = self.source.sources[source]
+            with profiler.span('text_extraction'):
+                text, spans = self.source.get_text_from_nodes(nodes), find_maskable_spans(nodes)
+            plan.files.append(self.plan_file(source, text, spans=spans))
+        return plan
+
+    def plan_matches(self, plan: TranslationPlan | None) -> bool:
+        """Whether a plan was made with the settings of this translator."""
+        return (
+            plan is not None and
+            plan.model == self.model and
+            plan.chunk_size == self.chunk_size and
+            plan.template is self.template and
+            plan.mask == self.mask
+        )
+
+    @asynccontextmanager
+    async def request_slot(self, source: str | None):
+        async with self.request_semaphore:
+            if self.aborted:
+                raise TranslationAborted('another request of the job failed')
+            # a file is ongoing once its first request is sent, not when its chunks are scheduled
+            if source not in self.started_files:
+                self.started_files.add(source)
+                if self.update_ongoing_file_cb:
+                    self.update_ongoing_file_cb(source)
+            try:
+                yield
+            except Exception:
+                self.aborted = True
+                raise
+
+    async def stream_chunk(self,
+                           chunk: PlannedChunk,
+                           index: int,
+                           writer: OrderedChunkWriter | None,
+                           metrics: RequestMetrics,
+                           ) -> str:
+        """Without a writer the text is only collected, e.g. to restore placeholders before writing it."""
+        text_filter = FencedTextFilter()
+        translated_parts, response_chunks = [], []
+
+        async def emit(text: str) -> None:
+            if text:
+                translated_parts.append(text)
+                if writer:
+                    await writer.write(index, text)
+
+        queued = time.perf_counter()
+        async with self.request_slot(metrics.source):
+            started = time.perf_counter()
+            try:
+                stream = await self.llm_client.chat_completion_stream(
+                    chunk.messages, prompt_tokens=chunk.prompt_tokens, metrics=metrics
+                )
+                async for response_chunk in stream:
+                    response_chunks.append(response_chunk)
+                    delta = response_chunk.choices[0].delta.content if response_chunk.choices else None
+                    if not delta:
+                        continue
+                    if metrics.time_to_first_token is None:
+                        metrics.time_to_first_token = time.perf_counter() - started - metrics.queue_wait
+                    n_tokens = len(token_offsets(delta, model=self.model))
+                    self.received_tokens += n_tokens
+                    if self.receive_tokens_cb:
+                        self.receive_tokens_cb(n_tokens)
+                    await emit(text_filter.feed(delta))
+            except Exception as e:
+                self.finish_request(metrics, queued, started, error=e)
+                raise
+        await emit(text_filter.finish())
+        # rebuild a complete response so that the usage accounting stays the same
+        response = load_litellm().stream_chunk_builder(response_chunks, messages=chunk.messages)
+        self.finish_request(metrics, queued, started, response)
+        record_completion_tokens(self.api_config, response.usage.completion_tokens)
+        return ''.join(translated_parts)
+
+    def finish_request(self,
+                       metrics: RequestMetrics,
+                       queued: float,
+                       started: float,
+                       response=None,
+                       error: Exception | None = None,
+                       ) -> None:
+        # the client added the time spent waiting for the rate limit to `queue_wait`
+        metrics.latency = time.perf_counter() - started - metrics.queue_wait
+        metrics.queue_wait += started - queued
+        if response is not None:
+            metrics.record_response(response)
+        if error is not None:
+            metrics.error = f'{type(error).__name__}: {error}'
+        self.telemetry.requests.append(metrics)
+
+    async def request_translation(self,
+                                  messages: list[dict[str, str]],
+                                  metrics: RequestMetrics,
+                                  prompt_tokens: int | None = None,
+                                  ) -> str:
+        queued = time.perf_counter()
+        async with self.request_slot(metrics.source):
+            started = time.perf_counter()
+            try:
+                response = await self.llm_client.chat_completion(
+                    messages, prompt_tokens=prompt_tokens, metrics=metrics
+                )
+            except Exception as e:
+                self.finish_request(metrics, queued, started, error=e)
+                raise
+        self.finish_request(metrics, queued, started, response)
+        return self.extract_translation(response.choices[0].message.content)
+
+    async def restore_placeholders(self, chunk: PlannedChunk, translated_txt: str, source: str | None, index: int) -> str:
+        restored = unmask(translated_txt, chunk.placeholders)
+        if restored is not None:
+            return restored
+        # a placeholder got lost or duplicated, translate the chunk again without masking
+        self.mask_failures += 1
+        messages = self.template.create_messages(chunk.text, cacheable=self.cache_prefix)
+        return await self.request_translation(
+            messages,
+            RequestMetrics(source, index, kind='fallback'),
+            count_tokens(messages=messages, model=self.model),
+        )
+
+    async def translate_chunk(self,
+                              chunk: PlannedChunk,
+                              index: int = 0,
+                              writer: OrderedChunkWriter | None = None,
+                              source: str | None = None,
+                              ) -> str:
+        streamed = False
+        if chunk.reused is not None:
+            self.reused_chunks += 1
+            self.telemetry.chunks['reused'] += 1
+            translated_txt = chunk.reused
+        else:
+            journaled = self.journal.lookup(source, index, chunk) if self.journal else None
+            translated_txt = self.cache.get(chunk.cache_key) if self.cache and journaled is None else journaled
+            if journaled is not None:
+                self.journaled_chunks += 1
+                self.telemetry.chunks['journal'] += 1
+            elif translated_txt is not None:
+                self.telemetry.chunks['cached'] += 1
             else:
-                translated_chunks.append(translated_txt.replace('```', ''))
+                if chunk.cache_key in self.batch_results:
+                    self.telemetry.chunks['batch'] += 1
+                    response = load_litellm().ModelResponse(**self.batch_results[chunk.cache_key])
+                    metrics = RequestMetrics(source, index, kind='batch')
+                    metrics.record_response(response)
+                    self.telemetry.requests.append(metrics)
+                    translated_txt = self.extract_translation(response.choices[0].message.content)
+                elif self.stream and writer:
+                    self.telemetry.chunks['requested'] += 1
+                    # placeholders are restored before anything reaches the file
+                    streamed = not chunk.placeholders
+                    translated_txt = await self.stream_chunk(
+                        chunk, index, writer if streamed else None, RequestMetrics(source, index, kind='stream')
+                    )
+                else:
+                    self.telemetry.chunks['requested'] += 1
+                    translated_txt = await self.request_translation(
+                        chunk.messages, RequestMetrics(source, index), chunk.prompt_tokens
+                    )
+                if chunk.placeholders:
+                    translated_txt = await self.restore_placeholders(chunk, translated_txt, source, index)
+                if self.cache:
+                    self.cache.put(chunk.cache_key, translated_txt)
+                if self.journal:
+                    self.journal.record(source, index, chunk, translated_txt)
+        if writer:
+            if not streamed:
+                await writer.write(index, translated_txt)
+            await writer.finish(index)
+        self.translated_chunks += 1
+        if self.complete_chunk_cb:
+            self.complete_chunk_cb()
+        return translated_txt
+
+    async def translate_chunks(self, planned_file: PlannedFile, writer: OrderedChunkWriter | None = None) -> str:
+        """Translate all chunks of a file. With a writer, the chunks are also written out in order as they complete."""
+        # all chunks are scheduled at once, the semaphore keeps the in-flight window bounded
+        # and gather() returns the results in the original chunk order
+        translated_chunks = await asyncio.gather(
+            *(self.translate_chunk(chunk, index, writer, planned_file.source)
+              for index, chunk in enumerate(planned_file.chunks)),
+            # a failed chunk must not leave the others running, their translations are journaled
+            return_exceptions=True,
+        )
+        error = first_error(translated_chunks)
+        if error is not None:
+            raise error
+        if planned_file.source is not None:
+            self.chunk_records[planned_file.source] = [
+                (chunk.text, translated) for chunk, translated in zip(planned_file.chunks, translated_chunks)
+            ]
         return ''.join(translated_chunks)
+
+    async def translate(self, text: str, source: str | None = None, writer: OrderedChunkWriter | None = None) -> str:
+        return await self.translate_chunks(self.plan_file(source, text), writer)
     
-    def estimate_tokens_cost(self, text: str) -> tuple[int, int]:
-        text_chunks = self.splitter.split_text(text)
-        result_tokens = 0
-        for chunk in text_chunks:
-            messages = self.template.create_messages(chunk)
-            message_tokens = count_tokens(messages)
-            result_tokens += message_tokens
-        translation_tokens = count_tokens(text)
-        result_tokens += translation_tokens
-        return len(text_chunks), result_tokens
+    def estimate_tokens_cost(self, text: str, source: str | None = None) -> WorkEstimate:
+        plan = self.new_plan()
+        plan.files.append(self.plan_file(source, text))
+        return plan.estimate()
     
-    def estimate_total_work(self) -> tuple[int, int]:
-        document_nodes = None
-        for node in self.source.sources[self.source.main_source]:
-            document_node = LatexSourcesLoader.find_env_node(node, 'document')
-            if document_node:
-                document_nodes = document_node.nodelist
-        
-        all_tex_sources = [self.source.get_text_from_nodes(document_nodes)]
-        for source in self.source.sources.keys():
-            if source == self.source.main_source:
-                continue
-            txt = self.source.get_text_from_nodes(self.source.sources[source])
-            all_tex_sources.append(txt)
-
-        total_chunks, total_tokens = 0, 0
-        for text in all_tex_sources:
-            n_chunks, n_tokens = self.estimate_tokens_cost(text)
-            total_chunks += n_chunks
-            total_tokens += n_tokens
-        return total_chunks, total_tokens
-        
+    def estimate_total_work(self) -> WorkEstimate:
+        """Builds the translation plan, `translate_project` executes it later."""
+        self.plan = self.build_plan()
+        return self.plan.estimate()
+
+    async def translate_file(self, planned_file: PlannedFile, to_dir: Path) -> None:
+        # sources in subfolders are not cloned into the output directory, their folder may not exist yet
+        (to_dir / planned_file.output).parent.mkdir(parents=True, exist_ok=True)
+        if self.stream:
+            async with aiofiles.open(to_dir / planned_file.output, 'w', encoding='utf-8') as f:
+                await f.write(planned_file.prefix)
+                await self.translate_chunks(planned_file, OrderedChunkWriter(f))
+                await f.write(planned_file.suffix)
+            return
+
+        translated_txt = await self.translate_chunks(planned_file)
+        with profiler.span('write'):
+            async with aiofiles.open(to_dir / planned_file.output, 'w', encoding='utf-8') as f:
+                await f.write(planned_file.prefix + translated_txt + planned_file.suffix)
+
     async def translate_project(self, to_dir: Path) -> None:
         # prepare counters
-        self.translation_responses = []
         self.translated_chunks = 0
+        self.received_tokens = 0
+        self.reused_chunks = 0
+        self.mask_failures = 0
+        self.journaled_chunks = 0
+        self.aborted = False
+        self.started_files = set()
+        self.chunk_records = {}
+        self.journal = JobJournal(to_dir / journal_filename)
+        interrupted = self.journal.load()
+        if interrupted and self.auto_chunk_size and interrupted['model'] == self.model:
+            # the chunk size was tuned after the interrupted run, its chunks need its size
+            self.set_chunk_size(interrupted['chunk_size'])
+        self.telemetry = RunTelemetry(self.model, self.chunk_size)
+        # the plan of the cost estimation, unless the settings changed since
+        if not self.plan_matches(self.plan):
+            self.plan = self.build_plan()
+        self.journal.open({'model': self.model, 'chunk_size': self.chunk_size, 'mask': self.mask})
 
-        # first translate latex text within \begin{document} \end{document}
-        document_nodes = None
-        text_before_document_env, text_after_document_env = '', '\n\\end{document}'
-        if self.update_ongoing_file_cb:
-            self.update_ongoing_file_cb(self.source.main_source)
-        for node in self.source.sources[self.source.main_source]:
-            document_node = LatexSourcesLoader.find_env_node(node, 'document')
-            if document_node:
-                document_nodes = document_node.nodelist
-                continue
-            if document_nodes is None:
-                text_before_document_env += node.latex_verbatim()
-            else:
-                text_after_document_env += node.latex_verbatim()
-        text_before_document_env += '\n\\begin{document}\n'
-
-        txt = self.source.get_text_from_nodes(document_nodes)
-        translated_txt = await self.translate(txt)
-        main_full_text = text_before_document_env + translated_txt + text_after_document_env
-
-        async with aiofiles.open(
-            to_dir / f'translated_main.tex', 'w', encoding='utf-8'
-            ) as f:
-            await f.write(main_full_text)
+        # the main source and every referenced tex file are translated concurrently,
+        # sharing the request window of this translator
+        try:
+            with profiler.span('translate'):
+                # every file settles before the journal is closed and the report is written
+                results = await asyncio.gather(
+                    *(self.translate_file(planned_file, to_dir) for planned_file in self.plan.files),
+                    return_exceptions=True,
+                )
+            error = first_error(results)
+            if error is not None:
+                raise error
+        finally:
+            self.journal.close()
+            self.telemetry.finish()
+            with profiler.span('write'):
+                self.telemetry.write_json(to_dir / report_filename)
+                self.telemetry.write_prometheus(to_dir / metrics_filename)
+            # a chunk size given by the user is not tuned
+            if self.auto_chunk_size:
+                chunk_size_tuner.update(
+                    self.model, self.chunk_size, self.telemetry.requests, self.chunk_size_limit
+                )
 
-        # then translate every referenced tex file
-        for source in self.source.sources.keys():
-            if source == self.source.main_source:
-                continue
-            if self.update_ongoing_file_cb:
-                self.update_ongoing_file_cb(source)
-            txt = self.source.get_text_from_nodes(self.source.sources[source])
-            translated_txt = await self.translate(txt)
-            
-            async with aiofiles.open(to_dir / source, 'w', encoding='utf-8') as f:
-                await f.write(translated_txt)
-        
+        # keep the chunk alignment so that the next version of the project can be translated incrementally
+        with profiler.span('write'):
+            async with aiofiles.open(to_dir / manifest_filename, 'w', encoding='utf-8') as f:
+                await f.write(PreviousTranslation.dumps(self.chunk_records))
+        self.journal.finish()
         return
     
     def get_total_usage(self) -> tuple[int, int] | None:
-        if self.translation_responses is None:
+        if self.telemetry is None:
             return None
-        
-        prompt_tokens, completion_tokens = 0, 0
-        for response in self.translation_responses:
-            try:
-                prompt_tokens += response['usage']['prompt_tokens']
-                completion_tokens += response['usage']['completion_tokens']
-            except KeyError as e:
-                continue
-        return prompt_tokens, completion_tokens
+        summary = self.telemetry.summary()
+        return summary['prompt_tokens'], summary['completion_tokens']
+
+    def get_cached_prompt_tokens(self) -> int | None:
+        """Prompt tokens the provider served from its prompt cache, billed at a discount."""
+        if self.telemetry is None:
+            return None
+        return sum(r.cached_tokens for r in self.telemetry.requests)
@@ -1,4 +1,6 @@
 
+from pathlib import Path
+
 from textual.app import ComposeResult
 from textual.widget import Widget
 from textual.screen import Screen
@@ -9,10 +11,16 @@ from textual.widgets import Button, ContentSwitcher, Label, Header, Footer
 from trans_latex.ui.localization import resources
 from trans_latex.ui.widgets import config_pages
 from trans_latex.ui.task import current_task
+from trans_latex.cache import TranslationCache
+from trans_latex.incremental import PreviousTranslation, manifest_filename
+from trans_latex.llm import warm_up
 
 
 class ConfigScreen(Screen):
     """Switch among different configuration pages"""
+
+    # previous-version folder the user was last told has no manifest, told once per folder
+    missing_manifest_dir: str | None = None
     
     def compose(self) -> ComposeResult:
         with VerticalScroll(id="sidebar"):
@@ -29,7 +37,7 @@ class ConfigScreen(Screen):
             yield config_pages.CostEstimation(id="step-4-page", classes='config-page')
         yield Header()
         yield Footer()
-        
+
     def on_config_page_finished(self, event: config_pages.ConfigPage.Finished) -> None:
         side_button_id = 'step-' + event.id[5]
         self.query_one('#' + f'{side_button_id}').add_class('side-button-finished')
@@ -67,9 +75,32 @@ class ConfigScreen(Screen):
         current_task.prompt_template    = self.query_one(config_pages.TranslationOptions).create_prompt_template()
         current_task.tex_sources        = self.query_one(config_pages.LatexProjectDir).project_loader
         current_task.llm_service_config = self.query_one(config_pages.APIKey).get_api_service_config()
-        current_task.chunk_size         = int(self.query_one('#chunk-size-input').value)
+        self.query_one(config_pages.APIKey).apply_rate_limit()
+        chunk_size                      = self.query_one('#chunk-size-input').value.strip()
+        current_task.chunk_size         = int(chunk_size) if chunk_size else None
+        current_task.max_concurrency    = max(1, int(self.query_one('#concurrency-input').value or 1))
+        current_task.stream             = self.query_one('#stream-checkbox').value
+        current_task.mask               = self.query_one('#mask-checkbox').value
         current_task.num_chunks         = self.query_one(config_pages.CostEstimation).total_chunks
+        if current_task.translation_cache is None:
+            current_task.translation_cache = TranslationCache()
+        previous_dir = self.query_one('#previous-dir-input').value.strip()
+        current_task.previous_translation = (
+            PreviousTranslation.from_dir(Path(previous_dir).expanduser()) if previous_dir else None
+        )
+        if previous_dir and current_task.previous_translation is None:
+            if previous_dir != self.missing_manifest_dir:
+                self.notify(
+                    resources.get(r'previous_dir_no_manifest').format(dir=previous_dir, file=manifest_filename),
+                    severity='warning',
+                    timeout=10,
+                )
+            self.missing_manifest_dir = previous_dir
+        else:
+            self.missing_manifest_dir = None
 
     def on_mount(self) -> None:
         self.query_one('#step-1').disabled = False
         self.query_one('#step-1').press()
+        # litellm and the tokenizer load while the user fills in step 1, a failure here shows up on first use
+        self.run_worker(warm_up, name='warm-up', thread=True, exit_on_error=False)
@@ -13,6 +13,7 @@ from textual.worker import Worker, WorkerState
 from trans_latex.ui.task import current_task
 from trans_latex.ui.utils import copy_files
 from trans_latex.translator import LatexProjectTranslator
+from trans_latex.profiling import profiler, profile_filename
 from trans_latex.ui.localization.string_res import resources
 
 
@@ -27,6 +28,9 @@ class ProgressScreen(Screen):
         if self.completed:
             yield Label(resources.get(r'completed_1'), classes='center-label')
             yield Label(resources.get(r'completed_2'), classes='center-label')
+            if profiler.enabled:
+                yield Label(resources.get(r'profile_written').format(file=profile_filename), classes='center-label')
+                yield Label(profiler.summary(), classes='center-label')
             with Middle():
                 yield Button(resources.get(r'open_folder'), variant='success')
         else:
@@ -35,6 +39,8 @@ class ProgressScreen(Screen):
                 with Vertical(id='progressbar-container'):
                     yield ProgressBar(id='progress-bar', total=current_task.num_chunks)
             yield Label('...', id='status-text', classes='center-label')
+            yield Label('', id='cache-text', classes='center-label')
+            yield Label('', id='tokens-text', classes='center-label')
     
     def on_mount(self) -> None:
         self.run_worker(self.translation_task, name='worker')
@@ -51,25 +57,47 @@ class ProgressScreen(Screen):
     async def translation_task(self) -> None:
         self.status_text = f'Preparing new folder {current_task.target_dir} ...'
         current_task.target_dir.mkdir(parents=True, exist_ok=True)
-        await copy_files(Path(current_task.tex_sources.project_dir), Path(current_task.target_dir))
+        await copy_files(
+            Path(current_task.tex_sources.project_dir),
+            Path(current_task.target_dir),
+            skip=current_task.tex_sources.translated_sources(),
+        )
 
         self.translator = LatexProjectTranslator(
             current_task.tex_sources,
             current_task.prompt_template,
             current_task.llm_service_config,
-            current_task.chunk_size
+            current_task.chunk_size,
+            current_task.max_concurrency,
+            current_task.translation_cache,
+            current_task.previous_translation,
+            current_task.stream,
+            plan=current_task.translation_plan,
+            mask=current_task.mask,
         )
         
         def complete_chunk() -> None:
             self.query_one(ProgressBar).advance(1.0)
+            if cache := self.translator.cache:
+                self.query_one('#cache-text').update(
+                    resources.get(r'cache_stats').format(hits=cache.hits, misses=cache.misses)
+                )
         
         def update_ongoing_file(name: str) -> None:
             self.log.info(f'going {name}')
             self.status_text = f'Translating: {name}'
+
+        def receive_tokens(n_tokens: int) -> None:
+            self.query_one('#tokens-text').update(
+                resources.get(r'received_tokens').format(n=self.translator.received_tokens)
+            )
         self.translator.complete_chunk_cb = complete_chunk
         self.translator.update_ongoing_file_cb = update_ongoing_file
+        self.translator.receive_tokens_cb = receive_tokens
 
         await self.translator.translate_project(current_task.target_dir)
+        if profiler.enabled:
+            profiler.dump(current_task.target_dir / profile_filename)
 
     async def on_worker_state_changed(self, event: Worker.StateChanged) -> None:
         if event.worker.is_finished and event.worker.state == WorkerState.SUCCESS:
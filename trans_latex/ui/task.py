@@ -4,6 +4,9 @@ from pathlib import Path
 from trans_latex.tex_source import LatexSourcesLoader
 from trans_latex.chat_prompt import ChatPromptTemplate
 from trans_latex.llm import LLMServiceConfig, check_valid_key
+from trans_latex.cache import TranslationCache
+from trans_latex.incremental import PreviousTranslation
+from trans_latex.plan import TranslationPlan
 
 
 class TranslationTask:
@@ -11,7 +14,15 @@ class TranslationTask:
     prompt_template: ChatPromptTemplate | None = None
     tex_sources: LatexSourcesLoader | None = None
     llm_service_config: LLMServiceConfig | None = None
+    # None lets the translator pick the chunk size
     chunk_size: int | None = None
+    max_concurrency: int = 1
+    stream: bool = False
+    mask: bool = False
+    translation_cache: TranslationCache | None = None
+    previous_translation: PreviousTranslation | None = None
+    # made by the cost estimation and executed by the translation
+    translation_plan: TranslationPlan | None = None
     num_chunks: int | None = None
     target_dir: Path | None = None
 
@@ -21,7 +32,7 @@ class TranslationTask:
             not self.tex_sources or
             not self.tex_sources.sources or
             not self.llm_service_config or
-            not isinstance(self.chunk_size, int) or
+            (self.chunk_size is not None and self.chunk_size <= 0) or
             not self.num_chunks
         ):
             return False
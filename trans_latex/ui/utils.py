@@ -1,27 +1,105 @@
-import aiohttp
-import aiofiles
+import os
+import sys
+import errno
+import shutil
+import asyncio
 from pathlib import Path
+from collections import Counter
+from collections.abc import Iterable
 
+from trans_latex.profiling import profiler
 
-async def adownload(url: str, save_path: Path) -> None:
-    async with aiohttp.ClientSession() as session:
-        async with session.get(url) as response:
-            if response.status != 200:
-                return
+if sys.platform == 'linux':
+    import fcntl
 
-            async with aiofiles.open(save_path, 'wb') as f:
-                while True:
-                    chunk = await response.content.read(1024)
-                    if not chunk:
-                        break
-                    await f.write(chunk)
 
+# files people may edit in the output directory, always given their own copy
+text_suffixes = {'.tex', '.bib', '.bbl', '.sty', '.cls', '.bst', '.txt', '.md', '.cfg', '.def', '.clo'}
+# ioctl of Linux filesystems with copy-on-write clones (btrfs, XFS, ...)
+FICLONE = 0x40049409
+_not_supported = {errno.EXDEV, errno.EOPNOTSUPP, errno.ENOTSUP, errno.EINVAL, errno.ENOSYS, errno.EPERM, errno.ETXTBSY}
 
-async def copy_files(src_dir: Path, dst_dir: Path) -> None:
-    for src_file in src_dir.rglob('*'):
-        if src_file.is_file():
-            dst_file = dst_dir / src_file.relative_to(src_dir)
-            dst_file.parent.mkdir(parents=True, exist_ok=True)
-            async with aiofiles.open(src_file, 'rb') as src, aiofiles.open(dst_file, 'wb') as dst:
-                await dst.write(await src.read())
 
+def _reflink(src: Path, dst: Path) -> bool:
+    if sys.platform != 'linux':
+        return False
+    with open(src, 'rb') as s, open(dst, 'wb') as d:
+        try:
+            fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+            return True
+        except OSError as e:
+            if e.errno not in _not_supported:
+                raise
+    dst.unlink()
+    return False
+
+
+def _copy_file_range(src: Path, dst: Path) -> bool:
+    if not hasattr(os, 'copy_file_range'):
+        return False
+    with open(src, 'rb') as s, open(dst, 'wb') as d:
+        remaining = os.fstat(s.fileno()).st_size
+        try:
+            while remaining > 0:
+                copied = os.copy_file_range(s.fileno(), d.fileno(), remaining)
+                if copied == 0:
+                    break
+                remaining -= copied
+            return True
+        except OSError as e:
+            if e.errno not in _not_supported:
+                raise
+    dst.unlink()
+    return False
+
+
+def clone_file(src: Path, dst: Path) -> str:
+    """Clone one file the cheapest way the filesystem allows, returns the method used.
+    Binary assets are hardlinked, so they must not be modified in place in the output directory."""
+    dst.parent.mkdir(parents=True, exist_ok=True)
+    # never write through a link left by an earlier clone
+    dst.unlink(missing_ok=True)
+    if src.suffix.lower() not in text_suffixes:
+        try:
+            os.link(src, dst)
+            return 'hardlink'
+        except OSError as e:
+            if e.errno not in _not_supported | {errno.EMLINK}:
+                raise
+    if _reflink(src, dst):
+        return 'reflink'
+    if _copy_file_range(src, dst):
+        return 'copy_file_range'
+    # sendfile on Linux, fcopyfile on macOS
+    shutil.copyfile(src, dst)
+    return 'copy'
+
+
+async def copy_files(src_dir: Path, dst_dir: Path, skip: Iterable[str] = (), max_workers: int = 8) -> Counter:
+    """Clone a project into the output directory, concurrently in worker threads.
+    `skip` holds paths relative to `src_dir`, such as the sources the translator writes anyway.
+    Returns how many files were cloned by each method."""
+    skip = {Path(p).as_posix() for p in skip}
+    dst_root = dst_dir.resolve()
+    semaphore = asyncio.Semaphore(max_workers)
+    methods = Counter()
+
+    async def clone(src_file: Path, dst_file: Path) -> None:
+        async with semaphore:
+            methods[await asyncio.to_thread(clone_file, src_file, dst_file)] += 1
+
+    with profiler.span('copy'):
+        tasks = []
+        for src_file in src_dir.rglob('*'):
+            if not src_file.is_file():
+                continue
+            relative = src_file.relative_to(src_dir)
+            # an output directory inside the project must not be cloned into itself
+            if src_file.resolve().is_relative_to(dst_root):
+                continue
+            if relative.as_posix() in skip:
+                methods['skipped'] += 1
+                continue
+            tasks.append(clone(src_file, dst_dir / relative))
+        await asyncio.gather(*tasks)
+    return methods
@@ -1,25 +1,26 @@
 
 from pathlib import Path
-import tarfile
+import aiohttp
 
 from textual.app import ComposeResult
 from textual.widget import Widget
 from textual.containers import Horizontal, VerticalScroll
-from textual.widgets import Button, Markdown, Input, TextArea, Collapsible, Label
+from textual.widgets import Button, Markdown, Input, TextArea, Collapsible, Label, Checkbox
 from textual.message import Message
 from textual.reactive import reactive, Reactive
 from textual.worker import Worker, WorkerState
 
 from trans_latex.ui.localization import resources
 from trans_latex.ui.widgets.labeled_input import InputWithLabel
-from trans_latex.ui.utils import adownload
 from trans_latex.ui.widgets.validate import ValidDirPath, ValidTemperature
 from trans_latex.ui.task import current_task
 
 from trans_latex.llm import LLMServiceConfig, check_valid_key
+from trans_latex.rate_limit import set_rate_limit
 from trans_latex.chat_prompt import ChatPromptTemplate
 from trans_latex.tex_source import LatexSourcesLoader
 from trans_latex.translator import LatexProjectTranslator
+from trans_latex.arxiv import download_arxiv_source
 
 
 class ConfigPage(Widget):
@@ -99,13 +100,11 @@ class LatexProjectDir(ConfigPage):
         event.stop()
     
     async def download_and_parse_latex_project(self, arxiv_identifier: str) -> None:
-        url = f'https://arxiv.org/src/{arxiv_identifier}'
-        save_dir = Path(f'~/.cache/translatex/{arxiv_identifier}').expanduser()
-        save_dir.mkdir(parents=True, exist_ok=True)
-        tar_path = save_dir / f'{arxiv_identifier}.tar.gz'
-        await adownload(url, tar_path)
-        with tarfile.open(tar_path, 'r:gz') as tar:
-            tar.extractall(path=save_dir)
+        try:
+            save_dir = await download_arxiv_source(arxiv_identifier)
+        except (aiohttp.ClientError, ValueError, OSError) as e:
+            self.status_text = f'Failed to fetch arXiv {arxiv_identifier}: {e}'
+            return
         await self.parse_latex_project(save_dir)
     
     async def parse_latex_project(self, project_dir: Path) -> None:
@@ -113,7 +112,10 @@ class LatexProjectDir(ConfigPage):
         ret = await self.project_loader.load_sources()
         if ret:
             self.is_valid_project = True
-            self.status_text = f'Project loaded successfully! Main source found: {self.project_loader.main_source}'
+            self.status_text = (f'Project loaded successfully in {self.project_loader.load_time:.2f}s! '
+                                f'Main source found: {self.project_loader.main_source}')
+            if self.project_loader.warnings:
+                self.status_text += '\n\n' + '\n'.join(f'- {w}' for w in self.project_loader.warnings)
         else:
             self.status_text = f'Failed.'
 
@@ -158,6 +160,18 @@ class APIKey(ConfigPage):
                 placeholder='0.2',
                 id='temperature-input',
             )
+            yield InputWithLabel(
+                'Requests / min',
+                placeholder=resources.get(r'p2_no_limit'),
+                type='integer',
+                id='rpm-input',
+            )
+            yield InputWithLabel(
+                'Tokens / min',
+                placeholder=resources.get(r'p2_no_limit'),
+                type='integer',
+                id='tpm-input',
+            )
 
             self.test_button = Button(
                 'Click to test the API', 
@@ -217,6 +231,17 @@ class APIKey(ConfigPage):
         except ValueError as e:
             return 0.1
     
+    def apply_rate_limit(self) -> None:
+        """Configure the client-side rate limit of the selected model at the selected API base."""
+        rpm = self.query_one('#rpm-input').value
+        tpm = self.query_one('#tpm-input').value
+        set_rate_limit(
+            rpm=int(rpm) if rpm else None,
+            tpm=int(tpm) if tpm else None,
+            model=self.query_one('#model-input').value,
+            api_base=self.query_one('#api-base-input').value,
+        )
+
     def get_api_service_config(self) -> LLMServiceConfig | None:
         data = LLMServiceConfig(
             api_base=self.query_one('#api-base-input').value,
@@ -248,10 +273,26 @@ class TranslationOptions(ConfigPage):
             )
             yield InputWithLabel(
                 'Token Chunk Size',
-                value='1000',
+                placeholder=resources.get(r'p3_chunk_size_auto'),
                 id='chunk-size-input',
-                type='number'
+                type='integer',
+                valid_empty=True,
+            )
+            yield InputWithLabel(
+                'Concurrent Requests',
+                value='4',
+                id='concurrency-input',
+                type='integer'
             )
+            yield InputWithLabel(
+                'Previous Version',
+                placeholder=resources.get(r'p3_previous_dir'),
+                validators=[ValidDirPath()],
+                valid_empty=True,
+                id='previous-dir-input',
+            )
+            yield Checkbox(resources.get(r'p3_stream'), value=False, id='stream-checkbox')
+            yield Checkbox(resources.get(r'p3_mask'), value=False, id='mask-checkbox')
 
             with Collapsible(title=resources.get(r'p3_collapse_title'), classes='collapse_prompt'):
                 yield Markdown(resources.get(r'p3_text_3'))
@@ -271,6 +312,10 @@ class TranslationOptions(ConfigPage):
     
     def on_mount(self) -> None:
         self.query_one('#chunk-size-input').tooltip = resources.get(r'chunk_size_tip')
+        self.query_one('#concurrency-input').tooltip = resources.get(r'concurrency_tip')
+        self.query_one('#previous-dir-input').tooltip = resources.get(r'previous_dir_tip')
+        self.query_one('#stream-checkbox').tooltip = resources.get(r'stream_tip')
+        self.query_one('#mask-checkbox').tooltip = resources.get(r'mask_tip')
         self.update_preview_md()
     
     def on_input_changed(self, event: Input.Changed):
@@ -324,16 +369,27 @@ class CostEstimation(ConfigPage):
             current_task.tex_sources,
             current_task.prompt_template,
             current_task.llm_service_config,
-            current_task.chunk_size
+            current_task.chunk_size,
+            cache=current_task.translation_cache,
+            previous=current_task.previous_translation,
+            mask=current_task.mask,
         )
         if not translator.source or not translator.source.sources:
             self.notify("Empty source.", severity='error')
             return
-        x, y = translator.estimate_total_work()
-
-        current_task.num_chunks = x
-
-        self.results_md.update(resources.get(r'p4_estimation_result').format(x=x, y=y))
+        estimate = translator.estimate_total_work()
+
+        current_task.translation_plan = translator.plan
+        current_task.num_chunks = self.total_chunks = translator.plan.num_chunks
+
+        self.results_md.update(resources.get(r'p4_estimation_result').format(
+            x=estimate.chunks - estimate.cached_chunks - estimate.reused_chunks,
+            y=estimate.tokens,
+            cached=estimate.cached_chunks,
+            reused=estimate.reused_chunks,
+            saved=estimate.saved_tokens,
+            discounted=estimate.discounted_tokens,
+        ))
         self.results_md.loading = False
 
         self.run_worker(current_task.is_ready(), exclusive=True, name='check_ready')